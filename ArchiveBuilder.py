@@ -0,0 +1,214 @@
+import logging
+import os
+import time
+import uuid
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+from PIL import Image
+from PdfBuilder import read_jpeg_info
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif")
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+}
+ARCHIVE_FORMATS = ("cbz", "epub")
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+def chapter_images(chapter_path):
+    # Page files in page order, for the PDF merge and the archives
+    return sorted(f for f in os.listdir(chapter_path) if f.endswith(IMAGE_EXTENSIONS))
+
+
+class ArchiveWriter:
+    # Pages are copied into a ZIP_STORED archive as they are: no decode, no
+    # re-encode, no compression, so packaging runs at disk copy speed.
+    # Written to a temporary file and renamed into place on close.
+    def __init__(self, path):
+        self.path = path
+        self.page_count = 0
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._zip = zipfile.ZipFile(self._tmp_path, "w", zipfile.ZIP_STORED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _store(self, image_path, name):
+        self._zip.write(image_path, name, compress_type=zipfile.ZIP_STORED)
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        if self._zip is None:
+            return
+        self._finish()
+        self._zip.close()
+        self._zip = None
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        if self._zip is None:
+            return
+        self._zip.close()
+        self._zip = None
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class CbzWriter(ArchiveWriter):
+    def add_image(self, image_path):
+        extension = os.path.splitext(image_path)[1].lower()
+        # Readers order pages by name, so number them
+        self._store(image_path, f"{self.page_count:05d}{extension}")
+        self.page_count += 1
+
+    def start_section(self, label):
+        # CBZ has no table of contents
+        pass
+
+
+class EpubWriter(ArchiveWriter):
+    # Fixed-layout EPUB 3 with one XHTML page per image. Only image headers
+    # are read, for the page dimensions.
+    def __init__(self, path, title):
+        super().__init__(path)
+        self.title = title
+        self._pages = []
+        self._sections = []
+        # The mimetype entry has to come first and uncompressed
+        self._zip.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        self._zip.writestr("META-INF/container.xml", CONTAINER_XML, zipfile.ZIP_STORED)
+
+    def start_section(self, label):
+        # The next page starts a table of contents entry
+        self._sections.append((self.page_count, label))
+
+    def add_image(self, image_path):
+        extension = os.path.splitext(image_path)[1].lower()
+        media_type = MEDIA_TYPES.get(extension)
+        if media_type is None:
+            raise OSError(f"Unsupported image type: {extension}")
+        width, height = self.image_size(image_path)
+        name = f"{self.page_count:05d}"
+        self._store(image_path, f"OEBPS/images/{name}{extension}")
+        self._zip.writestr(
+            f"OEBPS/pages/{name}.xhtml",
+            self._page_xhtml(f"../images/{name}{extension}", width, height),
+            zipfile.ZIP_STORED,
+        )
+        self._pages.append((name, f"images/{name}{extension}", media_type))
+        self.page_count += 1
+
+    @staticmethod
+    def image_size(image_path):
+        # From the JPEG frame header when possible, else from PIL, which also
+        # only reads the header
+        info = read_jpeg_info(image_path)
+        if info is not None:
+            return info[0], info[1]
+        with Image.open(image_path) as image:
+            return image.size
+
+    @staticmethod
+    def _page_xhtml(image_href, width, height):
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+            f'<head><title>Page</title><meta name="viewport" '
+            f'content="width={width}, height={height}"/></head>\n'
+            '<body style="margin:0">'
+            f'<img src={quoteattr(image_href)} alt="" '
+            f'style="width:{width}px;height:{height}px"/></body>\n</html>\n'
+        )
+
+    def _finish(self):
+        sections = self._sections or [(0, self.title)]
+        nav_items = "".join(
+            f'<li><a href="pages/{first_page:05d}.xhtml">{escape(label)}</a></li>'
+            for first_page, label in sections
+            if first_page < self.page_count
+        )
+        self._zip.writestr(
+            "OEBPS/nav.xhtml",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" '
+            'xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            f"<head><title>{escape(self.title)}</title></head>\n"
+            f'<body><nav epub:type="toc"><ol>{nav_items}</ol></nav></body>\n</html>\n',
+        )
+        manifest = [
+            '<item id="nav" href="nav.xhtml" '
+            'media-type="application/xhtml+xml" properties="nav"/>'
+        ]
+        spine = []
+        for position, (name, image_href, media_type) in enumerate(self._pages):
+            cover = ' properties="cover-image"' if position == 0 else ""
+            manifest.append(
+                f'<item id="img{name}" href="{image_href}" media-type="{media_type}"{cover}/>'
+            )
+            manifest.append(
+                f'<item id="page{name}" href="pages/{name}.xhtml" '
+                'media-type="application/xhtml+xml"/>'
+            )
+            spine.append(f'<itemref idref="page{name}"/>')
+        identifier = uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(self.path))
+        modified = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self._zip.writestr(
+            "OEBPS/content.opf",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+            'unique-identifier="id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'<dc:identifier id="id">urn:uuid:{identifier}</dc:identifier>\n'
+            f"<dc:title>{escape(self.title)}</dc:title>\n"
+            "<dc:language>en</dc:language>\n"
+            f'<meta property="dcterms:modified">{modified}</meta>\n'
+            '<meta property="rendition:layout">pre-paginated</meta>\n'
+            "</metadata>\n"
+            f"<manifest>{''.join(manifest)}</manifest>\n"
+            f"<spine>{''.join(spine)}</spine>\n"
+            "</package>\n",
+        )
+
+
+def open_archive(path, fmt, title):
+    if fmt == "cbz":
+        return CbzWriter(path)
+    if fmt == "epub":
+        return EpubWriter(path, title)
+    raise ValueError(f"Unknown archive format: {fmt}")
+
+
+def build_volume_archive(volume_path, cover_image_path, chapter_paths, fmt, title, logger=None):
+    logger = logger or logging.getLogger(__name__)
+    started = time.perf_counter()
+    with open_archive(volume_path, fmt, title) as writer:
+        writer.add_image(cover_image_path)
+        for chapter_path in chapter_paths:
+            writer.start_section(os.path.basename(chapter_path))
+            for image_file in chapter_images(chapter_path):
+                try:
+                    writer.add_image(os.path.join(chapter_path, image_file))
+                except OSError as e:
+                    logger.warning("Skipping %s: %s", image_file, e)
+        page_count = writer.page_count
+    return page_count, time.perf_counter() - started
@@ -0,0 +1,511 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+import traceback
+from contextlib import asynccontextmanager
+from functools import partial
+from urllib.parse import urlparse
+import aiohttp
+from HttpSession import DEFAULT_HEADERS
+from Manifest import Manifest
+from MangaScraper import MangaScraper
+from Utils import IncompleteDownload, Utils
+
+
+class PrioritySemaphore:
+    # asyncio.Semaphore that wakes the waiter with the lowest priority first
+    # instead of the longest waiting one; equal priorities stay first come,
+    # first served. Priorities compare like DownloadPool's.
+    def __init__(self, value):
+        self._value = value
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority=()):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we were cancelled, pass the slot on
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._value += 1
+
+    @asynccontextmanager
+    async def hold(self, priority=()):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AsyncMangaScraper(MangaScraper):
+    def __init__(
+        self,
+        logger,
+        max_in_flight=1000,
+        max_per_host=32,
+        max_chapters=16,
+        rate_limiter=None,
+        http_cache=None,
+        metrics=None,
+        progress=None,
+        bandwidth=None,
+        transcoder=None,
+        pdf_workers=None,
+        html_parser=None,
+        site_profiles=None,
+        page_store=None,
+        package_formats=("pdf",),
+    ):
+        super().__init__(
+            logger,
+            rate_limiter=rate_limiter,
+            http_cache=http_cache,
+            pdf_workers=pdf_workers,
+            html_parser=html_parser,
+            site_profiles=site_profiles,
+            page_store=page_store,
+            metrics=metrics,
+            progress=progress,
+            bandwidth=bandwidth,
+            package_formats=package_formats,
+            transcoder=transcoder,
+        )
+        self.max_in_flight = max_in_flight
+        self.max_per_host = max_per_host
+        self.max_chapters = max_chapters
+        self._session = None
+        self._global_slots = None
+        self._host_slots = {}
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc.lower()
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = PrioritySemaphore(self.max_per_host)
+            self._host_slots[host] = slot
+        return slot
+
+    async def fetch(self, url, return_bytes=False, max_retries=3):
+        rate_limiter = self.utils.rate_limiter
+        cache = None if return_bytes else self.utils.http_cache
+        host = rate_limiter.host_of(url)
+        kind = "bytes" if return_bytes else "html"
+        entry = cache.lookup(url) if cache else None
+        if entry and cache.is_fresh(entry):
+            body = await asyncio.to_thread(cache.read, url)
+            if body is not None:
+                self.metrics.inc("manga_http_cache_hits_total", host=host, result="fresh")
+                return body
+            entry = None
+        retries = 0
+        async with self._global_slots, self._host_slot(url).hold():
+            while retries < max_retries:
+                await asyncio.sleep(rate_limiter.reserve(url))
+                started = time.perf_counter()
+                status = "error"
+                try:
+                    headers = cache.conditional_headers(entry) if entry else None
+                    async with self._session.get(url, headers=headers) as response:
+                        status = response.status
+                        if entry and response.status == 304:
+                            rate_limiter.record_success(url)
+                            self.utils.record_request(host, kind, started, status)
+                            body = await asyncio.to_thread(cache.read, url, True)
+                            if body is not None:
+                                self.metrics.inc(
+                                    "manga_http_cache_hits_total", host=host, result="revalidated"
+                                )
+                                return body
+                            entry = None
+                            continue
+                        response.raise_for_status()
+                        raw = await response.read()
+                        body = raw if return_bytes else await response.text(errors="replace")
+                    rate_limiter.record_success(url)
+                    self.utils.record_request(host, kind, started, status, len(raw))
+                    if cache:
+                        cache.record_miss()
+                        self.metrics.inc("manga_http_cache_misses_total", host=host)
+                        await asyncio.to_thread(cache.store, url, body, response.headers)
+                    return body
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retries += 1
+                    self.utils.record_request(host, kind, started, status)
+                    self.utils.record_retry(host, kind, retries, max_retries)
+                    headers = getattr(e, "headers", None) or {}
+                    delay = rate_limiter.record_failure(
+                        url,
+                        retries,
+                        status=getattr(e, "status", None),
+                        retry_after=headers.get("Retry-After"),
+                    )
+                    self.logger.error(
+                        "HTTP request failed: %s. Retrying %s/%s",
+                        e,
+                        retries,
+                        max_retries,
+                    )
+                    if retries < max_retries:
+                        await asyncio.sleep(delay)
+
+        self.logger.error("Failed to retrieve data after %s attempts.", max_retries)
+        return None
+
+    async def fetch_to_file(
+        self, url, path, chunk_size=256 * 1024, max_retries=3, priority=()
+    ):
+        # Async counterpart of Utils.download_file: stream into `<path>.part`,
+        # resume it with a Range request and rename once the size checks out.
+        # `priority` orders the wait for a slot on the host.
+        rate_limiter = self.utils.rate_limiter
+        part_path = f"{path}.part"
+        host = rate_limiter.host_of(url)
+        retries = 0
+        async with self._global_slots, self._host_slot(url).hold(priority):
+            while retries < max_retries:
+                await asyncio.sleep(rate_limiter.reserve(url))
+                offset = (
+                    os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                )
+                headers = {"Range": f"bytes={offset}-"} if offset else None
+                started = time.perf_counter()
+                status = "error"
+                received = 0
+                try:
+                    async with self._session.get(url, headers=headers) as response:
+                        status = response.status
+                        if response.status == 416 and offset:
+                            await asyncio.to_thread(os.remove, part_path)
+                            raise IncompleteDownload(f"Stale partial download for {url}")
+                        response.raise_for_status()
+                        if response.status != 206:
+                            offset = 0
+                        expected = Utils.expected_length(
+                            response.status, response.headers, offset
+                        )
+                        f = await asyncio.to_thread(
+                            open, part_path, "ab" if offset else "wb"
+                        )
+                        try:
+                            async for chunk in response.content.iter_chunked(chunk_size):
+                                await asyncio.to_thread(f.write, chunk)
+                                received += len(chunk)
+                                if self.utils.bandwidth is not None:
+                                    await asyncio.sleep(
+                                        self.utils.bandwidth.reserve(len(chunk))
+                                    )
+                        finally:
+                            await asyncio.to_thread(f.close)
+                    size = await asyncio.to_thread(
+                        Utils.finish_download, part_path, path, expected
+                    )
+                    rate_limiter.record_success(url)
+                    self.utils.record_request(host, "image", started, status, received)
+                    return size
+                except (aiohttp.ClientError, asyncio.TimeoutError, IncompleteDownload) as e:
+                    retries += 1
+                    self.utils.record_request(host, "image", started, status, received)
+                    self.utils.record_retry(host, "image", retries, max_retries)
+                    headers = getattr(e, "headers", None) or {}
+                    delay = rate_limiter.record_failure(
+                        url,
+                        retries,
+                        status=getattr(e, "status", None),
+                        retry_after=headers.get("Retry-After"),
+                    )
+                    self.logger.error(
+                        "Download failed: %s. Retrying %s/%s", e, retries, max_retries
+                    )
+                    if retries < max_retries:
+                        await asyncio.sleep(delay)
+
+        self.logger.error("Failed to download %s after %s attempts.", url, max_retries)
+        return None
+
+    async def store_page(self, image_url, page_path, priority):
+        # PageStore.fetch on the event loop: a URL another chapter is already
+        # downloading is awaited and linked in instead of fetched again
+        store = self.page_store
+        sha256 = await asyncio.to_thread(store.link_known, image_url, page_path)
+        while sha256 is None:
+            running = store.begin_download(image_url)
+            if running is None:
+                break
+            # Shielded: cancelling this page must not cancel the shared Future
+            if await asyncio.shield(asyncio.wrap_future(running)) is None:
+                return None
+            sha256 = await asyncio.to_thread(store.link_known, image_url, page_path)
+        else:
+            return sha256
+        try:
+            sha256 = await asyncio.to_thread(store.link_known, image_url, page_path)
+            if sha256 is None:
+                staged_path, claim = await asyncio.to_thread(store.claim_staging, image_url)
+                try:
+                    size = await self.fetch_to_file(image_url, staged_path, priority=priority)
+                    if size is not None:
+                        sha256 = await asyncio.to_thread(
+                            store.commit, image_url, staged_path, page_path
+                        )
+                finally:
+                    await asyncio.to_thread(store.release_staging, staged_path, claim)
+        finally:
+            store.end_download(image_url, sha256)
+        return sha256
+
+    async def download_page_async(
+        self, image_url, page_path, index, total_pages, current_ch, position=0
+    ):
+        if self.cancelled.is_set():
+            return None
+        sha256 = None
+        try:
+            sha256 = await self.store_page(image_url, page_path, (position, index))
+        except Exception as e:
+            self.logger.error(
+                "Error while downloading image %s / %s - Chapter %s: %s\n%s",
+                index + 1,
+                total_pages,
+                current_ch,
+                e,
+                traceback.format_exc(),
+            )
+        self.report("page", chapter=current_ch, index=index, ok=sha256 is not None)
+        return sha256
+
+    async def download_files_async(
+        self,
+        url,
+        current_ch,
+        directory,
+        chapter_page_selector,
+        alternative_page_selectors,
+        manifest=None,
+        position=0,
+    ):
+        # Returns the number of pages that failed, None if the chapter could
+        # not be read
+        started = time.perf_counter()
+        image_urls = self.planned_pages.get(url)
+        if image_urls is None:
+            page_content = await self.fetch(url)
+            if page_content is None:
+                self.metrics.inc("manga_chapters_total", result="failed")
+                return
+            # Parsing is CPU bound, keep it off the event loop
+            image_urls = await asyncio.to_thread(
+                self.extract_image_urls,
+                page_content,
+                chapter_page_selector,
+                alternative_page_selectors,
+                url,
+            )
+        self.logger.info("Downloading Chapter %s from %s...", current_ch, url)
+        await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+        if len(image_urls) == 0:
+            self.metrics.inc("manga_chapters_total", result="empty")
+            return
+        self.logger.info("Found %s pages for Chapter %s", len(image_urls), current_ch)
+        self.logger.info("\rDownloading %s images", len(image_urls))
+        self.report("chapter", chapter=current_ch, pages=len(image_urls))
+        recorded = set()
+        if manifest is not None:
+            await asyncio.to_thread(
+                manifest.record_chapter,
+                url,
+                current_ch,
+                directory,
+                [
+                    (image_url, self.page_path(directory, index))
+                    for index, image_url in enumerate(image_urls)
+                ],
+            )
+            recorded = await asyncio.to_thread(manifest.completed_pages, url)
+        downloads = {}
+        for index, image_url in enumerate(image_urls):
+            page_path = self.page_path(directory, index)
+            existing_path = self.existing_page_path(directory, index)
+            if existing_path:
+                self.logger.info("Image %s already found. Skipping...", page_path)
+                self.metrics.inc("manga_pages_total", result="skipped")
+                self.report("page", chapter=current_ch, index=index, ok=True, skipped=True)
+                if manifest is not None and image_url and index not in recorded:
+                    await asyncio.to_thread(
+                        self.record_page_download, manifest, url, index, existing_path
+                    )
+                continue
+            if image_url:
+                downloads[(index, page_path)] = self.download_page_async(
+                    image_url, page_path, index, len(image_urls), current_ch, position
+                )
+        hashes = await asyncio.gather(*downloads.values())
+        failed = hashes.count(None)
+        self.record_chapter_metrics(started, len(hashes) - failed, failed)
+        if manifest is not None:
+            for (index, page_path), sha256 in zip(downloads, hashes):
+                if sha256 is not None:
+                    await asyncio.to_thread(
+                        self.record_page_download,
+                        manifest,
+                        url,
+                        index,
+                        page_path,
+                        sha256,
+                    )
+            await asyncio.to_thread(manifest.complete_chapter, url)
+        return failed
+
+    async def _scrape_chapter(
+        self, chapter, chapter_slots, args, manifest, download, position
+    ):
+        chapter_url, chapter_number, chapter_directory = chapter
+        (_, _, _, _, chapter_page_selector, _, alternative_selectors, merge_pdf) = args
+        failed = 0
+        if download:
+            async with chapter_slots:
+                if self.cancelled.is_set():
+                    return
+                failed = await self.download_files_async(
+                    chapter_url,
+                    chapter_number,
+                    chapter_directory,
+                    chapter_page_selector,
+                    alternative_selectors,
+                    manifest,
+                    position,
+                )
+            self.report("chapter_done", chapter=chapter_number)
+            if self.cancelled.is_set():
+                return
+        self.submit_chapter(chapter_directory, chapter_number, merge_pdf, manifest, failed == 0)
+
+    async def discover_chapters_async(
+        self, main_url, chapter_link_selector, start_ch, end_ch, manga_title, pagination=None
+    ):
+        self.logger.info("Getting Chapters from %s ...", main_url)
+        with self.metrics.timer("manga_stage_seconds", stage="listing"):
+            main_page_content = await self.fetch(main_url)
+            if not main_page_content:
+                return []
+            more_pages = []
+            if pagination is not None:
+                more_pages = await asyncio.to_thread(
+                    self.fetch_listing_pages,
+                    main_url,
+                    main_page_content,
+                    chapter_link_selector,
+                    pagination,
+                )
+        return await asyncio.to_thread(
+            self.select_chapters,
+            main_page_content,
+            chapter_link_selector,
+            start_ch,
+            end_ch,
+            manga_title,
+            main_url,
+            more_pages,
+        )
+
+    async def start_scraping_async(self, *args, sync=False, pagination=None, plan=None):
+        (
+            start_ch,
+            end_ch,
+            manga_title,
+            main_url,
+            _,
+            chapter_link_selector,
+            _,
+            _,
+        ) = args
+
+        self.log_arguments(args)
+        self.metrics.set_labels(series=manga_title)
+
+        self._global_slots = asyncio.Semaphore(self.max_in_flight)
+        self._host_slots = {}
+        connector = aiohttp.TCPConnector(
+            limit=self.max_in_flight, limit_per_host=self.max_per_host
+        )
+        timeout = aiohttp.ClientTimeout(total=60, sock_connect=10, sock_read=30)
+        manifest = None
+        try:
+            manifest = Manifest.for_title(manga_title)
+            async with aiohttp.ClientSession(
+                connector=connector, headers=DEFAULT_HEADERS, timeout=timeout
+            ) as session:
+                self._session = session
+                if plan is not None:
+                    chapters = self.use_plan(plan)
+                else:
+                    chapters = await self.discover_chapters_async(
+                        main_url, chapter_link_selector, start_ch, end_ch, manga_title, pagination
+                    )
+                if chapters:
+                    pending = set(
+                        await asyncio.to_thread(
+                            self.filter_chapters, chapters, manifest, sync
+                        )
+                    )
+                    self.report("series", title=manga_title, chapters=len(pending))
+                    chapter_slots = asyncio.Semaphore(self.max_chapters)
+                    await asyncio.gather(
+                        *(
+                            self._scrape_chapter(
+                                chapter,
+                                chapter_slots,
+                                args,
+                                manifest,
+                                chapter in pending,
+                                position,
+                            )
+                            for position, chapter in enumerate(chapters)
+                        )
+                    )
+                    await asyncio.to_thread(
+                        self.merge_pool.wait, partial(self.record_transcodes, manifest), manifest
+                    )
+                    self.log_cache_stats()
+                    self.log_store_stats()
+                    self.log_request_stats()
+                    self.logger.info("All done!")
+
+        except Exception as e:
+            self.logger.error(
+                "Error getting chapters for %s: %s\n %s",
+                manga_title,
+                e,
+                traceback.format_exc(),
+            )
+        finally:
+            self._session = None
+            if plan is not None:
+                self.forget_plan(plan)
+            if manifest is not None:
+                manifest.close()
+            self.metrics.flush()
+            self.report("done", title=manga_title)
+
+    def start_scraping(self, *args, sync=False, pagination=None, plan=None):
+        # Same entry point as MangaScraper, so it can be driven from a plain
+        # thread; the event loop lives for the duration of one series.
+        asyncio.run(
+            self.start_scraping_async(*args, sync=sync, pagination=pagination, plan=plan)
+        )
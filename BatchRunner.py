@@ -0,0 +1,385 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from ArchiveBuilder import ARCHIVE_FORMATS
+from ChapterListing import Pagination
+from DownloadPool import DownloadPool
+from HtmlParser import HtmlParser
+from HttpCache import HttpCache
+from HttpSession import HttpSession
+from MangaScraper import MangaScraper
+from Manifest import Manifest
+from Metrics import Metrics, serve_metrics
+from PageStore import PageStore
+from Planner import Budget, DownloadPlan, OverBudget, Planner, plan_path
+from RateLimiter import BandwidthLimiter, RateLimiter
+from SiteProfiles import SiteProfiles
+from Transcoder import TARGET_FORMATS, Transcoder
+
+REQUIRED_FIELDS = ("title", "url", "chapter_link_selector", "chapter_page_selector")
+
+
+def load_jobs(path):
+    # A JSON list of series, or an object with the list under "jobs". Each
+    # series needs REQUIRED_FIELDS; "start", "end", "alternative_page_selectors",
+    # "merge_pdf", "formats" (for merge_pdf, default ["pdf"]), "sync" and, for
+    # paginated chapter lists, "next_page_selector" and/or "listing_url_pattern"
+    # are optional. "start" and "end" are chapter numbers as the site prints
+    # them, e.g. "147.2"; JSON numbers are turned into those strings.
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    jobs = data.get("jobs") if isinstance(data, dict) else data
+    if not isinstance(jobs, list):
+        raise ValueError(f"Expected a list of jobs in {path}")
+    titles = set()
+    for position, job in enumerate(jobs, start=1):
+        if not isinstance(job, dict):
+            raise ValueError(f"Job {position} in {path} is not an object")
+        missing = [field for field in REQUIRED_FIELDS if not job.get(field)]
+        if missing:
+            raise ValueError(f"Job {position} in {path} is missing {', '.join(missing)}")
+        if job["title"] in titles:
+            raise ValueError(f"Duplicate job title in {path}: {job['title']}")
+        titles.add(job["title"])
+        for bound in ("start", "end"):
+            value = job.get(bound)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                job[bound] = str(value)
+            elif value is not None and not isinstance(value, str):
+                raise ValueError(f"{bound} of {job['title']} must be a chapter number")
+        if not isinstance(job.get("alternative_page_selectors", []), list):
+            raise ValueError(f"alternative_page_selectors of {job['title']} must be a list")
+        unknown = set(job.get("formats", ["pdf"])) - {"pdf", *ARCHIVE_FORMATS}
+        if unknown:
+            raise ValueError(f"Unknown formats for {job['title']}: {', '.join(sorted(unknown))}")
+        job_pagination(job)
+    return jobs
+
+
+def job_pagination(job):
+    if not job.get("next_page_selector") and not job.get("listing_url_pattern"):
+        return None
+    return Pagination(job.get("next_page_selector"), job.get("listing_url_pattern"))
+
+
+def job_args(job):
+    # Positional arguments of MangaScraper.start_scraping
+    return (
+        job.get("start"),
+        job.get("end"),
+        job["title"],
+        job["url"],
+        job["chapter_page_selector"],
+        job["chapter_link_selector"],
+        job.get("alternative_page_selectors", []),
+        job.get("merge_pdf", False),
+    )
+
+
+class SeriesLogger(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        return f"[{self.extra['series']}] {msg}", kwargs
+
+
+class BatchRunner:
+    # Runs many series without the GUI. All of them share one download pool
+    # (the global concurrency budget, queued fairly per host), one HTTP
+    # session, rate limiter, cache and page store, and optionally one
+    # bandwidth budget. Up to `max_series` series are scraped at a time.
+    def __init__(
+        self,
+        logger,
+        max_series=2,
+        max_workers=16,
+        max_per_host=4,
+        bandwidth=None,
+        rate=None,
+        pdf_workers=1,
+        metrics_dir=None,
+        transcoder=None,
+        budget=None,
+        trim=False,
+        dry_run=False,
+        from_plans=False,
+        lookahead=2,
+        parser_backend="html.parser",
+        metrics_port=None,
+    ):
+        self.logger = logger
+        self.max_series = max_series
+        self.lookahead = lookahead
+        self.pdf_workers = pdf_workers
+        self.metrics_dir = metrics_dir
+        # Prometheus endpoint over the metrics of every series, if set
+        self.metrics_port = metrics_port
+        self._series_metrics = {}
+        self.transcoder = transcoder
+        # With a Budget every series is planned before it downloads, and
+        # refused (or trimmed) if it does not fit. A dry run only plans.
+        self.budget = budget
+        self.trim = trim
+        self.dry_run = dry_run
+        # Execute the plans saved by an earlier dry run
+        self.from_plans = from_plans
+        # Besides the pool's workers, every series fetches chapter pages
+        # from its own prefetch threads
+        self.session = HttpSession(
+            logger, pool_maxsize=max_workers + max_series * max(lookahead, 1)
+        )
+        if rate:
+            # Leaves room to speed up from --rate, as from the default rate
+            self.rate_limiter = RateLimiter(logger, rate=rate, max_rate=max(rate * 4, 8.0))
+        else:
+            self.rate_limiter = RateLimiter(logger)
+        self.bandwidth = BandwidthLimiter(bandwidth) if bandwidth else None
+        self.download_pool = DownloadPool(max_workers, max_per_host)
+        self.http_cache = HttpCache()
+        self.html_parser = HtmlParser(parser_backend)
+        self.site_profiles = SiteProfiles()
+        self.page_store = PageStore()
+        self.stopping = threading.Event()
+        self._scrapers = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def scraper_for(self, job):
+        title = job["title"]
+        json_path = None
+        if self.metrics_dir:
+            json_path = os.path.join(self.metrics_dir, f"{title}.json")
+        return MangaScraper(
+            SeriesLogger(self.logger, {"series": title}),
+            session=self.session,
+            rate_limiter=self.rate_limiter,
+            http_cache=self.http_cache,
+            pdf_workers=self.pdf_workers,
+            html_parser=self.html_parser,
+            site_profiles=self.site_profiles,
+            page_store=self.page_store,
+            metrics=Metrics({"series": title}, json_path=json_path),
+            download_pool=self.download_pool,
+            bandwidth=self.bandwidth,
+            lookahead=self.lookahead,
+            package_formats=job.get("formats", ["pdf"]),
+            transcoder=self.transcoder,
+        )
+
+    def combined_metrics(self):
+        with self._lock:
+            sources = list(self._series_metrics.values())
+        return Metrics.merged(sources)
+
+    def plan_for(self, job, scraper):
+        path = plan_path(job["title"])
+        if self.from_plans:
+            return DownloadPlan.load(path)
+        if self.budget is None and not self.dry_run:
+            return None
+        manifest = Manifest.for_title(job["title"])
+        try:
+            plan = Planner(scraper, self.budget, self.trim).plan(
+                job_args(job), job.get("sync", False), job_pagination(job), manifest
+            )
+        finally:
+            manifest.close()
+        plan.save(path)
+        self.logger.info("Saved the plan for %s to %s", job["title"], path)
+        return plan
+
+    def run_job(self, job):
+        title = job["title"]
+        with self._lock:
+            if self.stopping.is_set() or title in self._cancelled:
+                return "cancelled"
+            scraper = self._scrapers[title] = self.scraper_for(job)
+            self._series_metrics[title] = scraper.metrics
+        try:
+            try:
+                plan = self.plan_for(job, scraper)
+            except OverBudget as e:
+                self.logger.error("Not downloading %s: %s", title, e)
+                return "over budget"
+            if self.dry_run:
+                return "planned"
+            scraper.start_scraping(
+                *job_args(job),
+                sync=job.get("sync", False),
+                pagination=job_pagination(job),
+                plan=plan,
+            )
+        finally:
+            # Chapter pages still queued for prefetch are not fetched
+            scraper.prefetch_pool.shutdown(cancel_futures=True)
+            scraper.merge_pool.shutdown()
+            with self._lock:
+                del self._scrapers[title]
+        return "cancelled" if scraper.cancelled.is_set() else "done"
+
+    def cancel(self, title):
+        with self._lock:
+            self._cancelled.add(title)
+            scraper = self._scrapers.get(title)
+        if scraper is not None:
+            self.logger.info("Cancelling %s", title)
+            scraper.cancel()
+
+    def shutdown(self):
+        # Graceful: pages already downloading finish, nothing new starts
+        self.stopping.set()
+        with self._lock:
+            scrapers = list(self._scrapers.values())
+        for scraper in scrapers:
+            scraper.cancel()
+
+    def abort(self):
+        # Hard stop: queued pages are dropped and nothing waits for the pages
+        # and merges still running. The caller is expected to exit.
+        self.shutdown()
+        self.download_pool.shutdown(wait=False, cancel_pending=True)
+
+    def run(self, jobs):
+        results = {}
+        aborted = False
+        server = None
+        if self.metrics_port is not None:
+            server = serve_metrics(self.combined_metrics, self.metrics_port)
+            self.logger.info("Serving metrics on port %s", server.server_address[1])
+        executor = ThreadPoolExecutor(max_workers=self.max_series, thread_name_prefix="series")
+        try:
+            futures = {executor.submit(self.run_job, job): job["title"] for job in jobs}
+            try:
+                wait(futures)
+            except KeyboardInterrupt:
+                aborted = True
+                self.abort()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            executor.shutdown()
+            for future, title in futures.items():
+                try:
+                    results[title] = future.result()
+                except Exception as e:
+                    results[title] = "failed"
+                    self.logger.error(
+                        "Error scraping %s: %s\n%s", title, e, traceback.format_exc()
+                    )
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            # After an abort series threads may still use the store and session
+            if not aborted:
+                self.download_pool.shutdown(wait=True)
+                self.page_store.close()
+                self.session.close()
+        for title, status in results.items():
+            self.logger.info("%s: %s", title, status)
+        return results
+
+
+def add_transcode_arguments(parser):
+    parser.add_argument("--max-width", type=int, help="downscale pages wider than this")
+    parser.add_argument("--convert", choices=TARGET_FORMATS, help="re-encode pages as this")
+    parser.add_argument("--quality", type=int, default=80, help="quality when re-encoding")
+    parser.add_argument(
+        "--fix-extensions", action="store_true", help="rename pages after their real format"
+    )
+
+
+def transcoder_from_args(args):
+    if not (args.max_width or args.convert or args.fix_extensions):
+        return None
+    return Transcoder(args.max_width, args.convert, args.quality)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape every series in a job file")
+    parser.add_argument("jobs", help="JSON job file")
+    parser.add_argument("--max-series", type=int, default=2, help="series scraped at once")
+    parser.add_argument("--workers", type=int, default=16, help="pages downloading at once")
+    parser.add_argument("--per-host", type=int, default=4, help="pages per host at once")
+    parser.add_argument("--bandwidth-kb", type=int, default=0, help="KB/s for all downloads")
+    parser.add_argument("--rate", type=float, default=None, help="initial requests/s per host")
+    parser.add_argument("--pdf-workers", type=int, default=1, help="PDF processes per series")
+    parser.add_argument("--metrics-dir", help="write each series' metrics as JSON here")
+    parser.add_argument(
+        "--metrics-port", type=int, help="serve Prometheus metrics on this local port"
+    )
+    parser.add_argument(
+        "--html-parser",
+        choices=HtmlParser.BACKENDS,
+        default="html.parser",
+        help="lxml is faster but may match differently on malformed HTML",
+    )
+    add_transcode_arguments(parser)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only plan each series and save the plan"
+    )
+    parser.add_argument("--from-plans", action="store_true", help="download the saved plans")
+    parser.add_argument("--max-disk-gb", type=float, help="disk budget, default the free space")
+    parser.add_argument("--max-transfer-gb", type=float, help="download budget for all series")
+    parser.add_argument("--max-hours", type=float, help="estimated time budget per series")
+    parser.add_argument(
+        "--trim", action="store_true", help="drop the newest chapters when over budget"
+    )
+    return parser.parse_args()
+
+
+def budget_from_args(args):
+    if not (args.dry_run or args.max_disk_gb or args.max_transfer_gb or args.max_hours):
+        return None
+    gigabyte = 1024**3
+    return Budget(
+        args.max_disk_gb * gigabyte if args.max_disk_gb else None,
+        args.max_transfer_gb * gigabyte if args.max_transfer_gb else None,
+        args.max_hours * 3600 if args.max_hours else None,
+    )
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format="[%(asctime)s] %(message)s", level=logging.INFO)
+    logger = logging.getLogger()
+    runner = BatchRunner(
+        logger,
+        max_series=args.max_series,
+        max_workers=args.workers,
+        max_per_host=args.per_host,
+        bandwidth=args.bandwidth_kb * 1024 if args.bandwidth_kb else None,
+        rate=args.rate,
+        pdf_workers=args.pdf_workers,
+        metrics_dir=args.metrics_dir,
+        parser_backend=args.html_parser,
+        metrics_port=args.metrics_port,
+        transcoder=transcoder_from_args(args),
+        budget=budget_from_args(args),
+        trim=args.trim,
+        dry_run=args.dry_run,
+        from_plans=args.from_plans,
+    )
+
+    def stop(signum, frame):
+        if runner.stopping.is_set():
+            raise KeyboardInterrupt
+        logger.warning("Finishing the pages in flight, interrupt again to abort")
+        runner.shutdown()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        results = runner.run(load_jobs(args.jobs))
+    except KeyboardInterrupt:
+        logger.warning("Aborted, pages still downloading are left as .part files")
+        logging.shutdown()
+        # A normal exit would join the series and download threads first
+        os._exit(130)
+    return 0 if all(status in ("done", "planned") for status in results.values()) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
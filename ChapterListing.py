@@ -0,0 +1,64 @@
+import re
+from ChapterParser import parse_chapter_number
+
+PAGE_PLACEHOLDER = "{page}"
+
+
+class Pagination:
+    # How a series spreads its chapter list over several listing pages; the
+    # main URL is always page 1. `url_pattern` is the URL of any page with
+    # {page} in place of its number. Without one the pattern is guessed from
+    # the first `next_selector` link, and if that fails the listing is
+    # crawled one next link at a time.
+    def __init__(self, next_selector=None, url_pattern=None, max_pages=500):
+        if not next_selector and not url_pattern:
+            raise ValueError("Pagination needs a next page selector or a URL pattern")
+        if url_pattern and PAGE_PLACEHOLDER not in url_pattern:
+            raise ValueError(f"URL pattern has no {PAGE_PLACEHOLDER}: {url_pattern}")
+        self.next_selector = next_selector
+        self.url_pattern = url_pattern
+        self.max_pages = max_pages
+
+
+def page_url(pattern, page):
+    return pattern.replace(PAGE_PLACEHOLDER, str(page))
+
+
+def guess_url_pattern(next_url, page=2):
+    # The link to page 2 with its last "2" made the placeholder, e.g.
+    # /series/x?page=2 -> /series/x?page={page}
+    matches = [m for m in re.finditer(r"\d+", next_url) if int(m.group()) == page]
+    if not matches:
+        return None
+    last = matches[-1]
+    return f"{next_url[:last.start()]}{PAGE_PLACEHOLDER}{next_url[last.end():]}"
+
+
+def page_number_regex(pattern):
+    head, _, tail = pattern.partition(PAGE_PLACEHOLDER)
+    return re.compile(f"{re.escape(head)}(\\d+){re.escape(tail)}")
+
+
+def merge_chapter_links(links):
+    # Links from several listing pages, oldest first, ordered by chapter
+    # number with each number kept once. Pages can overlap when the listing
+    # shifts while it is fetched. A link without a number stays after the
+    # numbered link it followed.
+    seen_numbers = set()
+    seen_urls = set()
+    keyed = []
+    last_number = float("-inf")
+    for position, link in enumerate(links):
+        number = parse_chapter_number(link["href"]) or parse_chapter_number(link.text)
+        if number is None:
+            if link["href"] in seen_urls:
+                continue
+        elif number in seen_numbers:
+            continue
+        else:
+            seen_numbers.add(number)
+            last_number = number
+        seen_urls.add(link["href"])
+        keyed.append((last_number, position, link))
+    keyed.sort(key=lambda item: item[:2])
+    return [link for _, _, link in keyed]
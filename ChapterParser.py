@@ -0,0 +1,86 @@
+import re
+from bisect import bisect_left
+from functools import lru_cache
+
+CHAPTER_NUMBER_PATTERN = re.compile(
+    r"(?:chapter|ch|issue|\/|\s|-|_)\s*(\d+(?:[\.-]\d+)?)", re.IGNORECASE
+)
+# "chapter" contains "ch", so looking for "ch" and "issue" covers all markers
+CHAPTER_MARKER_PATTERN = re.compile("ch|issue")
+
+
+def _to_number(match):
+    return float(match.replace("-", ".")) if ("." in match or "-" in match) else int(match)
+
+
+@lru_cache(maxsize=8192)
+def parse_chapter_number(input_str):
+    matches = CHAPTER_NUMBER_PATTERN.findall(input_str)
+    if not matches:
+        return None
+
+    # A number counts as marked when a "chapter", "ch" or "issue" marker is
+    # left in the string around it. Checking from the last match backwards
+    # with one split per distinct match gives the same answer as filtering
+    # every (match, fragment) pair, without the quadratic work. Matches are
+    # digits, "." and "-", so splitting the lowered string is equivalent.
+    lowered = input_str.lower()
+    if CHAPTER_MARKER_PATTERN.search(lowered):
+        search = CHAPTER_MARKER_PATTERN.search
+        checked = set()
+        for match in reversed(matches):
+            if match in checked:
+                continue
+            checked.add(match)
+            for part in lowered.split(match):
+                if search(part):
+                    return _to_number(match)
+
+    # If no filtered match is found, revert to the last found match as a fallback.
+    return _to_number(matches[-1])
+
+
+def chapter_number_candidates(value):
+    # The numbers whose str() is exactly `value`, mirroring the
+    # str(chapter_number) == start_ch comparison used for ranges.
+    candidates = []
+    for convert in (int, float):
+        try:
+            number = convert(value)
+        except (TypeError, ValueError):
+            continue
+        if str(number) == value:
+            candidates.append(number)
+    return candidates
+
+
+class ChapterIndex:
+    # Parses every chapter link once and keeps (number, position) pairs sorted
+    # so that range bounds are found with a binary search.
+    def __init__(self, links):
+        self.numbers = [
+            parse_chapter_number(href) or parse_chapter_number(text)
+            for href, text in links
+        ]
+        self._sorted = sorted(
+            (number, position)
+            for position, number in enumerate(self.numbers)
+            if number is not None
+        )
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def find(self, chapter):
+        # Position of the first chapter whose number prints as `chapter`
+        found = None
+        for number in chapter_number_candidates(chapter):
+            i = bisect_left(self._sorted, (number, -1))
+            while i < len(self._sorted) and self._sorted[i][0] == number:
+                candidate, position = self._sorted[i]
+                if str(candidate) == chapter:
+                    if found is None or position < found:
+                        found = position
+                    break
+                i += 1
+        return found
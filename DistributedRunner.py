@@ -0,0 +1,260 @@
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import traceback
+from BatchRunner import (
+    SeriesLogger,
+    add_transcode_arguments,
+    job_pagination,
+    load_jobs,
+    transcoder_from_args,
+)
+from JobQueue import JobQueue
+from MangaScraper import MangaScraper
+from Manifest import Manifest
+from Utils import Utils
+
+
+def chapter_payload(job, chapter):
+    chapter_url, chapter_number, chapter_directory = chapter
+    return {
+        "title": job["title"],
+        "chapter_url": chapter_url,
+        "chapter_number": chapter_number,
+        "directory": chapter_directory,
+        "chapter_page_selector": job["chapter_page_selector"],
+        "alternative_page_selectors": job.get("alternative_page_selectors", []),
+        "merge_pdf": job.get("merge_pdf", False),
+        "formats": job.get("formats", ["pdf"]),
+    }
+
+
+class Coordinator:
+    # Turns the series of a job file into one queue entry per chapter that
+    # the manifest does not already have.
+    def __init__(self, logger, queue):
+        self.logger = logger
+        self.queue = queue
+        self.scraper = MangaScraper(logger)
+
+    def enqueue_series(self, job):
+        scraper = self.scraper
+        manifest = Manifest.for_title(job["title"])
+        try:
+            chapters = scraper.discover_chapters(
+                job["url"],
+                job["chapter_link_selector"],
+                job.get("start"),
+                job.get("end"),
+                job["title"],
+                job_pagination(job),
+            )
+            pending = scraper.filter_chapters(chapters, manifest, job.get("sync", False))
+        finally:
+            manifest.close()
+        added = 0
+        for chapter in pending:
+            if self.queue.enqueue(chapter[0], chapter_payload(job, chapter)):
+                added += 1
+        self.logger.info("%s: queued %s of %s chapters", job["title"], added, len(pending))
+        return added
+
+    def enqueue(self, jobs):
+        return sum(self.enqueue_series(job) for job in jobs)
+
+
+class Worker:
+    # Claims chapter jobs one at a time and downloads (and merges) them.
+    # Run as many workers as bandwidth and per-IP limits allow, on one or
+    # several machines sharing the queue file and the download directory.
+    def __init__(
+        self,
+        logger,
+        queue,
+        worker_id=None,
+        lease_seconds=300,
+        poll_interval=5.0,
+        max_workers=8,
+        max_per_host=4,
+        transcoder=None,
+    ):
+        self.logger = logger
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.scraper = MangaScraper(logger, max_workers, max_per_host, transcoder=transcoder)
+        self.stopping = threading.Event()
+        self._manifests = {}
+
+    def manifest_for(self, title):
+        manifest = self._manifests.get(title)
+        if manifest is None:
+            manifest = self._manifests[title] = Manifest.for_title(title)
+        return manifest
+
+    def keep_lease(self, job, done, lost):
+        # Renews at a third of the lease so one slow renewal does not lose it.
+        # A lost lease stops the job: another worker may be running it.
+        while not done.wait(self.lease_seconds / 3):
+            if not self.queue.renew(job, self.worker_id, self.lease_seconds):
+                self.logger.warning("Lost the lease on %s, stopping it", job.key)
+                lost.set()
+                self.scraper.cancel()
+                return
+
+    def run_job(self, job):
+        payload = job.payload
+        scraper = self.scraper
+        scraper.logger = SeriesLogger(self.logger, {"series": payload["title"]})
+        scraper.metrics.set_labels(series=payload["title"])
+        manifest = self.manifest_for(payload["title"])
+        scraper.download_files(
+            payload["chapter_url"],
+            payload["chapter_number"],
+            payload["directory"],
+            payload["chapter_page_selector"],
+            payload["alternative_page_selectors"],
+            manifest,
+        )
+        if not manifest.is_chapter_complete(payload["chapter_url"]):
+            raise RuntimeError("Chapter is missing pages")
+        formats = payload.get("formats", ["pdf"]) if payload["merge_pdf"] else ()
+        if formats or scraper.transcoder is not None:
+            name = f"chapter_{payload['chapter_number']}"
+            pages = Utils.package_chapter(payload["directory"], name, formats, scraper.transcoder)
+            if pages:
+                scraper.record_transcodes(manifest, name, pages)
+
+    def run(self, exit_when_idle=False):
+        processed = 0
+        aborted = False
+        try:
+            while not self.stopping.is_set():
+                job = self.queue.claim(self.worker_id, self.lease_seconds)
+                if job is None:
+                    if exit_when_idle and not self.queue.counts()["leased"]:
+                        break
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                done = threading.Event()
+                lost = threading.Event()
+                renewer = threading.Thread(
+                    target=self.keep_lease, args=(job, done, lost), daemon=True
+                )
+                renewer.start()
+                try:
+                    self.run_job(job)
+                    if not lost.is_set():
+                        self.queue.complete(job, self.worker_id)
+                        processed += 1
+                except Exception as e:
+                    if not lost.is_set():
+                        self.logger.error(
+                            "Job %s failed (attempt %s): %s\n%s",
+                            job.key,
+                            job.attempts,
+                            e,
+                            traceback.format_exc(),
+                        )
+                        self.queue.fail(job, self.worker_id, e)
+                finally:
+                    done.set()
+                    renewer.join()
+                    if lost.is_set():
+                        # Left to whoever holds the lease now
+                        self.scraper.cancelled.clear()
+        except KeyboardInterrupt:
+            # Hard stop: queued pages are dropped and nothing waits for the
+            # ones downloading. The job's lease runs out and it is retried.
+            aborted = True
+            self.scraper.cancel()
+            self.scraper.download_pool.shutdown(wait=False, cancel_pending=True)
+            raise
+        finally:
+            # After an abort pool threads may still use the manifests
+            if not aborted:
+                for manifest in self._manifests.values():
+                    manifest.close()
+                self._manifests = {}
+                self.scraper.download_pool.shutdown()
+            self.scraper.metrics.flush()
+        self.logger.info("Worker %s processed %s chapters", self.worker_id, processed)
+        return processed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chapter job queue shared by many workers")
+    parser.add_argument("--queue", default="./manga_downloads/jobs.sqlite3")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="queue the missing chapters of a job file")
+    enqueue.add_argument("jobs", help="JSON job file, same format as BatchRunner.py")
+
+    worker = commands.add_parser("worker", help="claim and run chapter jobs")
+    worker.add_argument("--id", help="worker id, defaults to host:pid")
+    worker.add_argument("--lease", type=float, default=300, help="lease length in seconds")
+    worker.add_argument("--poll", type=float, default=5.0, help="seconds between idle polls")
+    worker.add_argument("--workers", type=int, default=8, help="pages downloading at once")
+    worker.add_argument("--per-host", type=int, default=4, help="pages per host at once")
+    worker.add_argument("--exit-when-idle", action="store_true")
+    add_transcode_arguments(worker)
+
+    commands.add_parser("status", help="show job counts and failures")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format="[%(asctime)s] %(message)s", level=logging.INFO)
+    logger = logging.getLogger()
+    queue = JobQueue(args.queue)
+    try:
+        if args.command == "enqueue":
+            Coordinator(logger, queue).enqueue(load_jobs(args.jobs))
+        elif args.command == "worker":
+            worker = Worker(
+                logger,
+                queue,
+                args.id,
+                args.lease,
+                args.poll,
+                args.workers,
+                args.per_host,
+                transcoder_from_args(args),
+            )
+
+            def stop(signum, frame):
+                if worker.stopping.is_set():
+                    raise KeyboardInterrupt
+                logger.warning("Finishing the current chapter, interrupt again to abort")
+                worker.stopping.set()
+
+            signal.signal(signal.SIGINT, stop)
+            signal.signal(signal.SIGTERM, stop)
+            try:
+                worker.run(args.exit_when_idle)
+            except KeyboardInterrupt:
+                logger.warning("Aborted, the current chapter will be retried")
+                logging.shutdown()
+                # A normal exit would join the download threads first
+                os._exit(130)
+        counts = queue.counts()
+        logger.info(
+            "Jobs: %s queued, %s leased, %s done, %s failed",
+            counts["queued"],
+            counts["leased"],
+            counts["done"],
+            counts["failed"],
+        )
+        for key, attempts, error in queue.failures():
+            logger.info("Failed after %s attempts: %s (%s)", attempts, key, error)
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
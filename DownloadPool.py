@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+class DownloadPool:
+    # Pages wait in one queue per host and are handed to the workers
+    # round-robin across hosts, so a series with thousands of queued pages on
+    # one CDN cannot starve the others. Each host has at most `max_per_host`
+    # pages in flight. Several scrapers can share one pool as a global budget.
+    # Within a host the lowest `priority` goes first, then the oldest; the
+    # scrapers pass (chapter position, page index) so the earliest chapters
+    # become readable first.
+    def __init__(self, max_workers=8, max_per_host=4):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="page-download"
+        )
+        self._queues = OrderedDict()
+        self._order = itertools.count()
+        self._in_flight = {}
+        self._running = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    @staticmethod
+    def host_of(url):
+        return urlparse(url).netloc.lower()
+
+    def submit(self, url, fn, *args, priority=(), **kwargs):
+        # Tasks without a priority sort before any prioritized one
+        future = Future()
+        host = self.host_of(url)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("cannot schedule new downloads after shutdown")
+            heapq.heappush(
+                self._queues.setdefault(host, []),
+                (priority, next(self._order), (future, fn, args, kwargs)),
+            )
+        self._dispatch()
+        return future
+
+    def _next_task(self):
+        # Called with the lock held. The host served goes to the back.
+        for host in list(self._queues):
+            if self._in_flight.get(host, 0) >= self.max_per_host:
+                continue
+            queue = self._queues.pop(host)
+            task = heapq.heappop(queue)[2]
+            if queue:
+                self._queues[host] = queue
+            return host, task
+        return None
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if self._running >= self.max_workers:
+                    return
+                picked = self._next_task()
+                if picked is None:
+                    self._idle.notify_all()
+                    return
+                host, task = picked
+                if not task[0].set_running_or_notify_cancel():
+                    # Cancelled while queued
+                    continue
+                self._running += 1
+                self._in_flight[host] = self._in_flight.get(host, 0) + 1
+            self._executor.submit(self._run, host, *task)
+
+    def _run(self, host, future, fn, args, kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._in_flight[host] -= 1
+            self._dispatch()
+
+    def queued(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        # Pages already downloading always finish; queued ones are dropped
+        # with cancel_pending, otherwise they are worked off first.
+        with self._lock:
+            self._closed = True
+            if cancel_pending:
+                for queue in self._queues.values():
+                    for _, _, task in queue:
+                        task[0].cancel()
+        self._dispatch()
+        if wait:
+            with self._lock:
+                self._idle.wait_for(lambda: not self._running and not self._queues)
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,125 @@
+import re
+import threading
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+    from cssselect import ExpressionError, SelectorError
+    from lxml.cssselect import CSSSelector
+    from lxml.etree import ParserError
+except ImportError:
+    lxml = None
+
+# tag, tag.class, tag#id, tag[attr=value] and combinations of those. Only
+# such selectors can be matched after parsing nothing but their own tags.
+SIMPLE_SELECTOR = re.compile(r"^\s*([a-zA-Z][\w-]*)((?:[.#][\w-]+|\[[^\]]*\])*)\s*$")
+
+
+def strained_tags(selectors):
+    # Tag names to keep for a partial parse, or None if any selector needs
+    # ancestors, siblings or positions and therefore the whole document.
+    names = set()
+    for selector in selectors:
+        for part in selector.split(","):
+            match = SIMPLE_SELECTOR.match(part)
+            if not match:
+                return None
+            names.add(match.group(1).lower())
+    return names
+
+
+_compiled = threading.local()
+
+
+def compile_lxml_selector(selector):
+    # Compiled once per thread; lxml selectors should not be shared between
+    # threads that evaluate them at the same time.
+    cache = getattr(_compiled, "selectors", None)
+    if cache is None:
+        cache = _compiled.selectors = {}
+    matcher = cache.get(selector)
+    if matcher is None:
+        matcher = cache[selector] = CSSSelector(selector, translator="html")
+    return matcher
+
+
+class SelectedElement:
+    # The part of a bs4 Tag the scrapers use: attribute lookup and text
+    __slots__ = ("attrs", "text")
+
+    def __init__(self, attrs, text):
+        self.attrs = attrs
+        self.text = text
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def __getitem__(self, key):
+        return self.attrs[key]
+
+
+class SoupDocument:
+    def __init__(self, content, tags=None):
+        parse_only = SoupStrainer(list(tags)) if tags else None
+        self._soup = BeautifulSoup(content, "html.parser", parse_only=parse_only)
+
+    def select(self, selector):
+        return [SelectedElement(dict(tag.attrs), tag.text) for tag in self._soup.select(selector)]
+
+
+class LxmlDocument:
+    def __init__(self, content):
+        self._content = content
+        self._soup = None
+        try:
+            self._root = lxml.html.document_fromstring(content)
+        except ValueError:
+            # Unicode input with an XML encoding declaration
+            self._root = lxml.html.document_fromstring(content.encode("utf-8"))
+
+    def select(self, selector):
+        try:
+            matcher = compile_lxml_selector(selector)
+        except (SelectorError, ExpressionError):
+            # Selector syntax only soupsieve understands
+            if self._soup is None:
+                self._soup = SoupDocument(self._content)
+            return self._soup.select(selector)
+        return [
+            SelectedElement(dict(element.attrib), str(element.text_content()))
+            for element in matcher(self._root)
+        ]
+
+
+class HtmlParser:
+    # html.parser, the parser the scrapers always used, is the default.
+    # lxml is several times faster but opt-in: it builds a different tree
+    # from malformed HTML (unclosed <li>, <p> or <a>), so the same selector
+    # can match other elements or text. "auto" picks lxml when installed.
+    # `partial` only applies to html.parser; lxml always builds the whole
+    # document, since building only some tags needs a Python parser target,
+    # which made lxml parses 1.5-2x slower than its full tree built in C.
+    BACKENDS = ("auto", "lxml", "html.parser")
+
+    def __init__(self, backend="html.parser", partial=True):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown HTML parser backend: {backend}")
+        if backend == "lxml" and lxml is None:
+            raise ValueError("The lxml backend needs lxml and cssselect installed")
+        if backend == "auto":
+            backend = "lxml" if lxml is not None else "html.parser"
+        self.backend = backend
+        self.partial = partial and backend == "html.parser"
+
+    def parse(self, content, selectors):
+        # `selectors` are all the selectors that will be run on the document,
+        # used to decide how much of it has to be built.
+        if self.backend == "lxml":
+            try:
+                return LxmlDocument(content)
+            except ParserError:
+                # Empty or unparseable documents, let html.parser have a go;
+                # they are small, so a full parse costs nothing
+                pass
+        tags = strained_tags(selectors) if self.partial else None
+        return SoupDocument(content, tags)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class HttpCache:
+    def __init__(
+        self,
+        directory="./manga_downloads/.http_cache",
+        max_bytes=256 * 1024 * 1024,
+        max_entries=None,
+        fresh_for=0,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # Entries younger than this many seconds are served without even a
+        # conditional request; 0 means always revalidate.
+        self.fresh_for = fresh_for
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._total_bytes = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            key = name[: -len(".json")]
+            if os.path.exists(self._body_path(key)):
+                self._entries[key] = entry
+                self._total_bytes += entry.get("size", 0)
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _body_path(self, key):
+        return os.path.join(self.directory, f"{key}.body")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _write_meta(self, key, entry):
+        tmp_path = f"{self._meta_path(key)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._meta_path(key))
+
+    def lookup(self, url):
+        with self._lock:
+            entry = self._entries.get(self.key(url))
+            return dict(entry) if entry else None
+
+    def is_fresh(self, entry):
+        return self.fresh_for > 0 and time.time() - entry["stored"] < self.fresh_for
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read(self, url, revalidated=False):
+        # Serves a cached body after a fresh lookup or a 304, and counts the
+        # hit. Returns None if the entry vanished in the meantime.
+        key = self.key(url)
+        try:
+            with open(self._body_path(key), encoding="utf-8") as f:
+                body = f.read()
+        except OSError:
+            self._drop(key)
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return body
+            entry["accessed"] = time.time()
+            if revalidated:
+                entry["stored"] = entry["accessed"]
+                self.revalidations += 1
+            self.hits += 1
+            self._write_meta(key, entry)
+        return body
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def store(self, url, body, headers):
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified and not self.fresh_for:
+            # Nothing to revalidate against, caching would never pay off
+            return
+        key = self.key(url)
+        data = body.encode("utf-8")
+        tmp_path = f"{self._body_path(key)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        now = time.time()
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": len(data),
+            "stored": now,
+            "accessed": now,
+        }
+        with self._lock:
+            os.replace(tmp_path, self._body_path(key))
+            previous = self._entries.get(key)
+            if previous:
+                self._total_bytes -= previous.get("size", 0)
+            self._entries[key] = entry
+            self._total_bytes += entry["size"]
+            self._write_meta(key, entry)
+            self._evict()
+
+    def _evict(self):
+        over_entries = (
+            self.max_entries is not None and len(self._entries) > self.max_entries
+        )
+        if self._total_bytes <= self.max_bytes and not over_entries:
+            return
+        by_age = sorted(self._entries, key=lambda k: self._entries[k]["accessed"])
+        for key in by_age:
+            over_entries = (
+                self.max_entries is not None and len(self._entries) > self.max_entries
+            )
+            if self._total_bytes <= self.max_bytes and not over_entries:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._total_bytes -= entry.get("size", 0)
+        for path in (self._body_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _drop(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
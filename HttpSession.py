@@ -0,0 +1,82 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36",
+    "Connection": "keep-alive",
+}
+
+
+class HttpSession:
+    def __init__(
+        self,
+        logger,
+        pool_connections=10,
+        pool_maxsize=16,
+        retries=2,
+        backoff_factor=0.5,
+        headers=None,
+    ):
+        self.logger = logger
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        if headers:
+            self.session.headers.update(headers)
+
+        # Only connection errors are retried here. Error statuses and their
+        # Retry-After go back to the caller so RateLimiter sees every one of
+        # them and alone decides how long to back off.
+        retry = Retry(
+            total=retries,
+            status=0,
+            backoff_factor=backoff_factor,
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+            pool_block=False,
+        )
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.session.head(url, **kwargs)
+
+    def pool_stats(self):
+        # urllib3 counts new sockets (num_connections) and requests sent
+        # (num_requests) per pool; the difference is how many requests
+        # reused a kept-alive connection.
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            stats[host] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "reused": max(pool.num_requests - pool.num_connections, 0),
+            }
+        return stats
+
+    def log_pool_stats(self):
+        for host, stats in self.pool_stats().items():
+            self.logger.info(
+                "Connection pool %s: %s requests over %s connections (%s reused)",
+                host,
+                stats["requests"],
+                stats["connections"],
+                stats["reused"],
+            )
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, id);
+"""
+
+RECLAIM_EXPIRED = (
+    "UPDATE jobs SET state = 'queued', lease_owner = NULL, lease_expires = NULL, "
+    "error = 'lease expired', updated = ? WHERE state = 'leased' AND lease_expires < ?"
+)
+
+
+class Job:
+    __slots__ = ("id", "key", "payload", "attempts")
+
+    def __init__(self, id, key, payload, attempts):
+        self.id = id
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+
+
+class JobQueue:
+    # Durable work queue in one SQLite file, shared by any number of worker
+    # processes. A claimed job is leased to its worker until `lease_expires`;
+    # workers renew the lease while they run, and a lease that runs out (the
+    # worker died or hung) puts the job back in the queue. Sharing the file
+    # between machines needs a filesystem with working SQLite locking.
+    def __init__(self, path="./manga_downloads/jobs.sqlite3", max_attempts=5):
+        self.path = path
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit, so claim() can take the write lock up front
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def _transaction(self, statements):
+        # Runs (sql, params) pairs under BEGIN IMMEDIATE and returns the last
+        # cursor, so read-then-write sequences cannot interleave across processes.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = None
+                for sql, params in statements:
+                    cursor = self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+                return cursor
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, key, payload):
+        # Idempotent per key. A finished or failed job is queued again, since
+        # callers only enqueue work they know is still missing.
+        now = time.time()
+        cursor = self._transaction(
+            [
+                (
+                    "INSERT INTO jobs (key, payload, created, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = 'queued', attempts = 0, "
+                    "error = NULL, payload = excluded.payload, updated = excluded.updated "
+                    "WHERE jobs.state IN ('done', 'failed')",
+                    (key, json.dumps(payload), now, now),
+                )
+            ]
+        )
+        return cursor.rowcount > 0
+
+    def reclaim_expired(self):
+        now = time.time()
+        cursor = self._transaction([(RECLAIM_EXPIRED, (now, now))])
+        return cursor.rowcount
+
+    def claim(self, owner, lease_seconds=300):
+        # Oldest queued job, leased to `owner`, or None if there is none.
+        # Expired leases are reclaimed first.
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(RECLAIM_EXPIRED, (now, now))
+                row = self._conn.execute(
+                    "SELECT id, key, payload, attempts FROM jobs "
+                    "WHERE state = 'queued' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'leased', lease_owner = ?, "
+                        "lease_expires = ?, attempts = attempts + 1, updated = ? "
+                        "WHERE id = ?",
+                        (owner, now + lease_seconds, now, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return Job(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+    def renew(self, job, owner, lease_seconds=300):
+        # False once the lease was lost, in which case the job may already be
+        # running elsewhere.
+        now = time.time()
+        cursor = self._transaction(
+            [
+                (
+                    "UPDATE jobs SET lease_expires = ?, updated = ? "
+                    "WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                    (now + lease_seconds, now, job.id, owner),
+                )
+            ]
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job, owner):
+        now = time.time()
+        cursor = self._transaction(
+            [
+                (
+                    "UPDATE jobs SET state = 'done', lease_owner = NULL, "
+                    "lease_expires = NULL, error = NULL, updated = ? "
+                    "WHERE id = ? AND lease_owner = ?",
+                    (now, job.id, owner),
+                )
+            ]
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job, owner, error):
+        # Back into the queue until max_attempts, then parked as failed
+        now = time.time()
+        state = "failed" if job.attempts >= self.max_attempts else "queued"
+        cursor = self._transaction(
+            [
+                (
+                    "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, "
+                    "error = ?, updated = ? WHERE id = ? AND lease_owner = ?",
+                    (state, str(error), now, job.id, owner),
+                )
+            ]
+        )
+        return cursor.rowcount > 0
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        counts = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update(rows)
+        return counts
+
+    def failures(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, attempts, error FROM jobs WHERE state = 'failed' ORDER BY id"
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,13 +1,168 @@
 import traceback
 import os
-from bs4 import BeautifulSoup
+import threading
+import time
 from Utils import Utils
-import urllib
+import urllib.parse
+from collections import Counter
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from ChapterListing import guess_url_pattern, merge_chapter_links, page_number_regex, page_url
+from ChapterParser import ChapterIndex
+from DownloadPool import DownloadPool
+from HttpCache import HttpCache
+from HtmlParser import HtmlParser
+from HttpSession import HttpSession
+from Manifest import Manifest
+from Metrics import Metrics
+from PageStore import PageStore
+from PdfPipeline import PdfMergePool
+from SiteProfiles import IMAGE_ATTRIBUTES, SiteProfiles
+from Transcoder import PAGE_EXTENSIONS
+
 
 class MangaScraper:
-    def __init__(self, logger):
+    def __init__(
+        self,
+        logger,
+        max_workers=8,
+        max_per_host=4,
+        session=None,
+        rate_limiter=None,
+        http_cache=None,
+        pdf_workers=None,
+        html_parser=None,
+        site_profiles=None,
+        page_store=None,
+        metrics=None,
+        progress=None,
+        download_pool=None,
+        bandwidth=None,
+        lookahead=2,
+        package_formats=("pdf",),
+        transcoder=None,
+    ):
         self.logger = logger
-        self.utils = Utils(logger)
+        self.metrics = metrics or Metrics()
+        # Called with one dict per progress event, from any thread
+        self.progress = progress
+        # Chapter URL -> page image URLs, from the DownloadPlans being executed
+        self.planned_pages = {}
+        self.cancelled = threading.Event()
+        self.html_parser = html_parser or HtmlParser()
+        self.site_profiles = site_profiles or SiteProfiles()
+        self.page_store = page_store or PageStore()
+        # One pooled session serves the chapter list, chapter pages and images
+        self.utils = Utils(
+            logger,
+            session or HttpSession(logger, pool_maxsize=max_workers + max(lookahead, 1)),
+            rate_limiter,
+            http_cache or HttpCache(),
+            self.metrics,
+            bandwidth,
+        )
+        # A pool passed in is shared with other scrapers and not ours to close
+        self.download_pool = download_pool or DownloadPool(max_workers, max_per_host)
+        # Chapters whose page lists are fetched ahead of the one downloading
+        self.lookahead = lookahead
+        self.prefetch_pool = ThreadPoolExecutor(
+            max_workers=max(lookahead, 1), thread_name_prefix="chapter-prefetch"
+        )
+        # What "merge into PDF" builds per chapter: any of pdf, cbz and epub
+        self.package_formats = tuple(package_formats)
+        # Optional Transcoder run on each finished chapter, before packaging
+        self.transcoder = transcoder
+        self.merge_pool = PdfMergePool(logger, Utils.package_chapter, pdf_workers, self.metrics)
+
+    def extract_image_urls(
+        self, page_content, chapter_page_selector, alternative_page_selectors, url=None
+    ):
+        # The selector and attribute that last worked for this host go first
+        host = SiteProfiles.host_of(url) if url else None
+        selectors = [chapter_page_selector, *alternative_page_selectors]
+        attributes = IMAGE_ATTRIBUTES
+        if host:
+            selectors = self.site_profiles.selector_order(host, selectors)
+            attributes = self.site_profiles.attribute_order(host)
+
+        image_urls = []
+        document = self.html_parser.parse(page_content, selectors)
+        pages = []
+        matched_selector = None
+        for position, selector in enumerate(selectors):
+            if position > 0:
+                self.logger.info(
+                    "Trying alternative selector %s from %s",
+                    selector,
+                    alternative_page_selectors,
+                )
+            pages = document.select(selector)
+            if len(pages) > 0:
+                matched_selector = selector
+                break
+
+        attribute_hits = Counter()
+        seen = set()
+        for page in pages:
+            image_url = None
+            for attribute in attributes:
+                image_url = page.get(attribute, None)
+                if image_url and image_url.startswith("http"):
+                    attribute_hits[attribute] += 1
+                    break
+            if image_url not in seen:
+                seen.add(image_url)
+                image_urls.append(image_url)
+
+        if host and matched_selector:
+            self.site_profiles.learn(
+                host,
+                matched_selector,
+                attribute_hits.most_common(1)[0][0] if attribute_hits else None,
+            )
+        return image_urls
+
+    def cancel(self):
+        # Pages already downloading finish; queued ones and the remaining
+        # chapters are skipped.
+        self.cancelled.set()
+
+    def report(self, event, **fields):
+        if self.progress is not None:
+            self.progress({"event": event, **fields})
+
+    @staticmethod
+    def page_path(directory, index):
+        return f"{directory}/{'0' + str(index) if index < 10 else index}.jpg"
+
+    @staticmethod
+    def existing_page_path(directory, index):
+        # The transcode stage may have given the page another extension
+        name = f"0{index}" if index < 10 else str(index)
+        for stem in dict.fromkeys((name, str(index))):
+            for extension in PAGE_EXTENSIONS:
+                page_path = f"{directory}/{stem}{extension}"
+                if os.path.exists(page_path):
+                    return page_path
+        return None
+
+    @staticmethod
+    def page_exists(directory, index):
+        return MangaScraper.existing_page_path(directory, index) is not None
+
+    def fetch_chapter_pages(self, url, chapter_page_selector, alternative_page_selectors):
+        # Page image URLs of a chapter, or None if its HTML could not be
+        # fetched. Runs ahead of the downloads on the prefetch threads.
+        planned = self.planned_pages.get(url)
+        if planned is not None:
+            return planned
+        page_content = self.utils.make_request(url)
+        if page_content is None:
+            return None
+        with self.metrics.profile("extract_image_urls"):
+            return self.extract_image_urls(
+                page_content, chapter_page_selector, alternative_page_selectors, url
+            )
 
     def download_files(
         self,
@@ -16,62 +171,168 @@ class MangaScraper:
         directory,
         chapter_page_selector,
         alternative_page_selectors,
+        manifest=None,
     ):
-        page_content = self.utils.make_request(url)
-        if page_content is None:
-            return
-        image_urls = []
+        started = time.perf_counter()
+        image_urls = self.fetch_chapter_pages(
+            url, chapter_page_selector, alternative_page_selectors
+        )
+        queued = self.queue_pages(url, current_ch, directory, image_urls, manifest, started)
+        if queued is not None:
+            self.finish_pages(queued, manifest)
+
+    def queue_pages(
+        self, url, current_ch, directory, image_urls, manifest=None, started=None, position=0
+    ):
+        # Submits the missing pages of a chapter to the download pool without
+        # waiting for them. Returns what finish_pages needs, or None if there
+        # is nothing to wait for. `position` is the chapter's place in the
+        # run; lower positions and page indexes download first.
+        started = started or time.perf_counter()
+        if image_urls is None:
+            self.metrics.inc("manga_chapters_total", result="failed")
+            return None
         self.logger.info("Downloading Chapter %s from %s...", current_ch, url)
-        soup = BeautifulSoup(page_content, "html.parser")
-        pages = soup.select(chapter_page_selector)
-        if len(pages) == 0 and len(alternative_page_selectors) > 0:
-            for alternative_selector in alternative_page_selectors:
-                self.logger.info(
-                    "Trying alternative selector %s from %s",
-                    alternative_selector,
-                    alternative_page_selectors,
-                )
-                pages = soup.select(alternative_selector)
-                if len(pages) > 0:
-                    break
         if not os.path.exists(directory):
             os.makedirs(directory)
-        if len(pages) == 0:
-            return
-        for page in pages:
-            image_url = page.get("src", None)
-            if not image_url or not image_url.startswith("http"):
-                image_url = page.get("data-lazy-src", None)
-            if not image_url or not image_url.startswith("http"):
-                image_url = page.get("data-src", None)
-            if not image_url in image_urls:
-                image_urls.append(image_url)
+        if len(image_urls) == 0:
+            self.metrics.inc("manga_chapters_total", result="empty")
+            return None
         self.logger.info("Found %s pages for Chapter %s", len(image_urls), current_ch)
         self.logger.info("\rDownloading %s images", len(image_urls))
+        self.report("chapter", chapter=current_ch, pages=len(image_urls))
+        recorded = set()
+        if manifest is not None:
+            manifest.record_chapter(
+                url,
+                current_ch,
+                directory,
+                [
+                    (image_url, self.page_path(directory, index))
+                    for index, image_url in enumerate(image_urls)
+                ],
+            )
+            recorded = manifest.completed_pages(url)
+        futures = {}
         for index, image_url in enumerate(image_urls):
-            page_path = f"{directory}/{'0' + str(index) if index < 10 else index}.jpg"
-            if os.path.exists(page_path) or os.path.exists(f"{directory}/{index}.jpg"):
+            if self.cancelled.is_set():
+                break
+            page_path = self.page_path(directory, index)
+            existing_path = self.existing_page_path(directory, index)
+            if existing_path:
                 self.logger.info("Image %s already found. Skipping...", page_path)
+                self.metrics.inc("manga_pages_total", result="skipped")
+                self.report("page", chapter=current_ch, index=index, ok=True, skipped=True)
+                if manifest is not None and image_url and index not in recorded:
+                    self.record_page_download(manifest, url, index, existing_path)
                 continue
             if image_url:
-                try:
-                    page_response = self.utils.make_request(
-                        image_url, return_bytes=True
-                    )
-                    if page_response:
-                        with open(page_path, "wb") as f:
-                            f.write(page_response)
-                except Exception as e:
-                    self.logger.error(
-                        "Error while downloading image %s / %s - Chapter %s: %s\n%s",
-                        index + 1,
-                        len(pages),
-                        current_ch,
-                        e,
-                        traceback.format_exc(),
-                    )
+                future = self.download_pool.submit(
+                    image_url,
+                    self.download_page,
+                    image_url,
+                    page_path,
+                    index,
+                    len(image_urls),
+                    current_ch,
+                    priority=(position, index),
+                )
+                futures[future] = (index, page_path)
+        return url, started, futures
+
+    def finish_pages(self, queued, manifest=None):
+        # Returns the number of pages that failed
+        url, started, futures = queued
+        wait(futures)
+        failed = sum(1 for future in futures if future.result() is None)
+        self.record_chapter_metrics(started, len(futures) - failed, failed)
+        if manifest is not None:
+            for future, (index, page_path) in futures.items():
+                sha256 = future.result()
+                if sha256 is not None:
+                    self.record_page_download(manifest, url, index, page_path, sha256)
+            manifest.complete_chapter(url)
+        return failed
+
+    @staticmethod
+    def pages_done(queued):
+        return queued is None or all(future.done() for future in queued[2])
+
+    def record_chapter_metrics(self, started, downloaded, failed):
+        self.metrics.observe("manga_stage_seconds", time.perf_counter() - started, stage="chapter")
+        self.metrics.inc("manga_pages_total", downloaded, result="downloaded")
+        self.metrics.inc("manga_pages_total", failed, result="failed")
+        self.metrics.inc("manga_chapters_total", result="failed" if failed else "downloaded")
+
+    @staticmethod
+    def record_page_download(manifest, chapter_url, index, page_path, sha256=None):
+        manifest.record_page(
+            chapter_url,
+            index,
+            page_path,
+            os.path.getsize(page_path),
+            sha256 or Utils.hash_file(page_path),
+        )
+
+    def download_page(self, image_url, page_path, index, total_pages, current_ch):
+        if self.cancelled.is_set():
+            return None
+        sha256 = None
+        try:
+            sha256 = self.page_store.fetch(self.utils, image_url, page_path)
+        except Exception as e:
+            self.logger.error(
+                "Error while downloading image %s / %s - Chapter %s: %s\n%s",
+                index + 1,
+                total_pages,
+                current_ch,
+                e,
+                traceback.format_exc(),
+            )
+        self.report("page", chapter=current_ch, index=index, ok=sha256 is not None)
+        return sha256
+
+    def log_cache_stats(self):
+        stats = self.utils.http_cache.stats()
+        self.logger.info(
+            "HTML cache: %s hits (%s revalidated), %s misses, %s entries, %s bytes",
+            stats["hits"],
+            stats["revalidations"],
+            stats["misses"],
+            stats["entries"],
+            stats["bytes"],
+        )
+
+    def log_store_stats(self):
+        stats = self.page_store.stats()
+        self.logger.info(
+            "Page store: %s known URLs and %s duplicate images reused, %s bytes saved",
+            stats["url_hits"],
+            stats["content_hits"],
+            stats["bytes_saved"],
+        )
 
-    def start_scraping(self, *args):
+    def log_request_stats(self):
+        # Slowest hosts first, to spot a CDN holding the run back
+        hosts = sorted(
+            self.metrics.histograms("manga_http_request_seconds"),
+            key=lambda item: item[1].sum / item[1].count,
+            reverse=True,
+        )
+        for labels, histogram in hosts:
+            self.logger.info(
+                "%s %s: %s requests, %.3fs mean, p95 <= %ss, %s retries",
+                labels.get("host"),
+                labels.get("kind"),
+                histogram.count,
+                histogram.sum / histogram.count,
+                histogram.quantile(0.95),
+                self.metrics.counter_value(
+                    "manga_http_retries_total", host=labels.get("host"), kind=labels.get("kind")
+                ),
+            )
+
+    def log_arguments(self, args):
         (
             start_ch,
             end_ch,
@@ -80,7 +341,7 @@ class MangaScraper:
             chapter_page_selector,
             chapter_link_selector,
             alternative_chapter_page_selector,
-            merge_images_into_pdf,
+            _,
         ) = args
 
         self.logger.info(
@@ -94,76 +355,410 @@ class MangaScraper:
             f"ALTERNATIVE_CHAPTER_PAGE_SELECTOR: {alternative_chapter_page_selector}\n"
         )
 
+    def next_listing_url(self, document, page_url, next_selector):
+        for link in document.select(next_selector):
+            href = link.get("href")
+            if href:
+                return urllib.parse.urljoin(page_url, href)
+        return None
+
+    def listing_page_count(self, document, base_url, pattern):
+        # Highest page number linked from a listing page, or None
+        regex = page_number_regex(pattern)
+        numbers = []
+        for link in document.select("a"):
+            href = link.get("href")
+            match = regex.fullmatch(urllib.parse.urljoin(base_url, href)) if href else None
+            if match:
+                numbers.append(int(match.group(1)))
+        return max(numbers, default=None)
+
+    def fetch_listing_urls(self, urls):
+        # Concurrently, within the per-host limit of the download pool
+        futures = [self.download_pool.submit(url, self.utils.make_request, url) for url in urls]
+        contents = [future.result() for future in futures]
+        for url, content in zip(urls, contents):
+            if content is None:
+                self.logger.warning("Could not fetch listing page %s", url)
+        return contents
+
+    def fetch_listing_pages(self, main_url, main_page_content, chapter_link_selector, pagination):
+        # Contents of listing pages 2 and up, in page order. With a URL
+        # pattern (given or guessed) the pages are fetched concurrently, as
+        # far as the page links seen so far reach; pagination widgets that
+        # only show nearby pages are followed from the last page fetched.
+        selectors = [selector for selector in (pagination.next_selector, "a") if selector]
+        document = self.html_parser.parse(main_page_content, selectors)
+        pattern = pagination.url_pattern
+        if pattern is None:
+            next_url = self.next_listing_url(document, main_url, pagination.next_selector)
+            if next_url is None:
+                return []
+            pattern = guess_url_pattern(next_url)
+            if pattern is None:
+                return self.crawl_listing_pages(next_url, pagination)
+        page_count = self.listing_page_count(document, main_url, pattern)
+        if page_count is None:
+            return self.probe_listing_pages(pattern, chapter_link_selector, pagination)
+        contents = []
+        fetched = 1
+        while fetched < min(page_count, pagination.max_pages):
+            last_page = min(page_count, pagination.max_pages)
+            urls = [page_url(pattern, page) for page in range(fetched + 1, last_page + 1)]
+            self.logger.info("Fetching listing pages %s to %s", fetched + 1, last_page)
+            contents.extend(self.fetch_listing_urls(urls))
+            fetched = last_page
+            if contents[-1] is None:
+                break
+            document = self.html_parser.parse(contents[-1], ["a"])
+            page_count = max(page_count, self.listing_page_count(document, urls[-1], pattern) or 0)
+        return [content for content in contents if content is not None]
+
+    def probe_listing_pages(self, pattern, chapter_link_selector, pagination):
+        # No page numbers to go by: fetch a batch at a time until a page
+        # fails or lists no chapters
+        batch = max(self.download_pool.max_per_host, 1)
+        contents = []
+        page = 2
+        while page <= pagination.max_pages:
+            last_page = min(page + batch - 1, pagination.max_pages)
+            urls = [page_url(pattern, number) for number in range(page, last_page + 1)]
+            for content in self.fetch_listing_urls(urls):
+                if content is None or not self.html_parser.parse(
+                    content, [chapter_link_selector]
+                ).select(chapter_link_selector):
+                    return contents
+                contents.append(content)
+            page = last_page + 1
+        return contents
+
+    def crawl_listing_pages(self, next_url, pagination):
+        # Next links only, one page after the other
+        self.logger.info("No page number in %s, following next links", next_url)
+        contents = []
+        seen = {next_url}
+        while next_url is not None and len(contents) + 1 < pagination.max_pages:
+            content = self.utils.make_request(next_url)
+            if content is None:
+                break
+            contents.append(content)
+            document = self.html_parser.parse(content, [pagination.next_selector])
+            next_url = self.next_listing_url(document, next_url, pagination.next_selector)
+            if next_url in seen:
+                break
+            seen.add(next_url)
+        return contents
+
+    def select_chapters(
+        self,
+        main_page_content,
+        chapter_link_selector,
+        start_ch,
+        end_ch,
+        manga_title,
+        main_url,
+        more_pages=(),
+    ):
+        # `more_pages` are the contents of listing pages 2 and up
+        chapters = []
+        for content in (main_page_content, *more_pages):
+            document = self.html_parser.parse(content, [chapter_link_selector])
+            chapters.extend(document.select(chapter_link_selector))
+        if not chapters:
+            return []
+        chapters.reverse()
+        if more_pages:
+            chapters = merge_chapter_links(chapters)
+        self.logger.info(f"Found {len(chapters)} chapters for {manga_title}")
+
+        # Every link is parsed once; both bounds are then binary searches
+        index = ChapterIndex((chapter["href"], chapter.text) for chapter in chapters)
+
+        start_ch_index = 0
+        # Initialize with the total number of chapters
+        end_ch_index = len(chapters)
+
+        if start_ch is not None:
+            position = index.find(start_ch)
+            if position is not None:
+                start_ch_index = position
+            else:
+                self.logger.warning(
+                    "Chapter %s not found. Starting from the beginning.",
+                    start_ch,
+                )
+
+        if end_ch is not None:
+            position = index.find(end_ch)
+            if position is not None:
+                end_ch_index = position + 1  # +1 to include the end chapter in the slice
+            else:
+                self.logger.warning(
+                    "Chapter %s not found. Downloading up to the last available chapter.",
+                    end_ch,
+                )
+
+        selected = []
+        for chapter in chapters[start_ch_index:end_ch_index]:
+            chapter_number = self.utils.parse_chapter_number(chapter["href"])
+            chapter_directory = f"./manga_downloads/{manga_title}/chapter_{chapter_number}"
+            chapter_url = chapter["href"]
+            if not chapter_url.startswith("http"):
+                if chapter_url.startswith("/"):
+                    chapter_url = str(urllib.parse.urljoin(main_url, chapter_url))
+            selected.append((chapter_url, chapter_number, chapter_directory))
+        return selected
+
+    def filter_chapters(self, chapters, manifest, sync=False):
+        # Decides from the manifest alone, so finished chapters cost no requests.
+        # In sync mode every chapter seen by an earlier run is left alone and
+        # only chapters that appeared since then are fetched.
+        known_urls = manifest.known_chapter_urls() if sync else set()
+        pending = []
+        for chapter in chapters:
+            chapter_url, chapter_number, _ = chapter
+            if chapter_url in known_urls:
+                continue
+            if manifest.is_chapter_complete(chapter_url):
+                self.logger.info(
+                    "Chapter %s already downloaded. Skipping...", chapter_number
+                )
+                continue
+            pending.append(chapter)
+        if sync:
+            self.logger.info("Sync: %s new chapters since the last run", len(pending))
+        return pending
+
+    def submit_chapter(
+        self, chapter_directory, chapter_number, merge_images_into_pdf, manifest, complete=True
+    ):
+        # Transcodes and builds in the background while the next chapters
+        # download. A "chapter_ready" event follows as soon as the chapter
+        # can be read: right away when there is nothing to build. The run's
+        # manifest groups its builds in the merge pool, which may be shared
+        # with other runs of this scraper.
+        if not os.path.isdir(chapter_directory):
+            return
+        if not merge_images_into_pdf and self.transcoder is None:
+            self.chapter_ready(chapter_number, chapter_directory, [], complete)
+            return
+        name = f"chapter_{chapter_number}"
+        formats = self.package_formats if merge_images_into_pdf else ()
+        future = self.merge_pool.submit(
+            chapter_directory, name, manifest, formats=formats, transcoder=self.transcoder
+        )
+        future.add_done_callback(
+            partial(
+                self.chapter_packaged, chapter_number, chapter_directory, name, formats, complete
+            )
+        )
+
+    def chapter_packaged(self, chapter_number, chapter_directory, name, formats, complete, future):
+        # On the process pool's result thread, not the scraping one. A failed
+        # build still makes the chapter ready, as loose pages and incomplete,
+        # so nobody waits for it forever; merge_pool.wait logs the error.
+        if future.cancelled() or future.exception() is not None:
+            self.chapter_ready(chapter_number, chapter_directory, [], False)
+            return
+        files = [
+            os.path.join(chapter_directory, f"{name}.{fmt}")
+            for fmt in formats
+            if os.path.exists(os.path.join(chapter_directory, f"{name}.{fmt}"))
+        ]
+        self.chapter_ready(chapter_number, chapter_directory, files, complete)
+
+    def chapter_ready(self, chapter_number, chapter_directory, files, complete):
+        self.logger.info("Chapter %s is ready", chapter_number)
+        self.report(
+            "chapter_ready",
+            chapter=chapter_number,
+            directory=chapter_directory,
+            files=files,
+            complete=complete,
+        )
+
+    def record_transcodes(self, manifest, name, pages):
+        original = sum(page.original_size for page in pages)
+        result = sum(page.size for page in pages)
+        self.metrics.inc("manga_transcode_bytes_total", original, kind="original")
+        self.metrics.inc("manga_transcode_bytes_total", result, kind="result")
+        for action, count in Counter(page.action for page in pages).items():
+            self.metrics.inc("manga_transcode_pages_total", count, result=action)
+        if manifest is not None:
+            manifest.record_transcodes(pages)
+        self.logger.info(
+            "Transcoded %s: %s pages, %s -> %s bytes", name, len(pages), original, result
+        )
+
+    def finish_chapter(self, chapter, queued, merge_images_into_pdf, manifest):
+        _, chapter_number, chapter_directory = chapter
+        failed = 0
+        if queued is not None:
+            failed = self.finish_pages(queued, manifest)
+        self.report("chapter_done", chapter=chapter_number)
+        if self.cancelled.is_set():
+            # Not every page is there, no PDF for it
+            return
+        self.submit_chapter(
+            chapter_directory, chapter_number, merge_images_into_pdf, manifest, not failed
+        )
+
+    def finish_next_chapter(self, in_flight, merge_images_into_pdf, manifest):
+        # Finishes whichever in-flight chapter has all its pages first, so a
+        # chapter is packaged the moment it is complete even while an
+        # earlier one is still waiting on a slow page
+        while True:
+            for entry in in_flight:
+                if self.pages_done(entry[1]):
+                    in_flight.remove(entry)
+                    self.finish_chapter(*entry, merge_images_into_pdf, manifest)
+                    return
+            wait(
+                [
+                    future
+                    for _, queued in in_flight
+                    for future in queued[2]
+                    if not future.done()
+                ],
+                return_when=FIRST_COMPLETED,
+            )
+
+    def download_chapters(
+        self,
+        chapters,
+        pending,
+        chapter_page_selector,
+        alternative_page_selectors,
+        merge_images_into_pdf,
+        manifest,
+    ):
+        # The page lists of the next `lookahead` pending chapters are fetched
+        # while the current chapter downloads, and up to `lookahead` chapters
+        # beyond it have their pages queued in the pool, so the download
+        # workers never sit idle waiting on page discovery.
+        upcoming = [chapter for chapter in chapters if chapter in pending]
+        discoveries = {}
+        in_flight = []
+        position = 0
         try:
-            self.logger.info("Getting Chapters from %s ...", main_url)
-            main_page_content = self.utils.make_request(main_url)
-            if main_page_content:
-                soup = BeautifulSoup(main_page_content, "html.parser")
-                chapters = soup.select(chapter_link_selector)
-                if chapters:
-                    chapters.reverse()
-                    self.logger.info(
-                        f"Found {len(chapters)} chapters for {manga_title}"
+            for chapter in chapters:
+                if self.cancelled.is_set():
+                    self.logger.info("Cancelled, stopping before the next chapter")
+                    break
+                chapter_url, chapter_number, chapter_directory = chapter
+                if chapter not in pending:
+                    self.submit_chapter(
+                        chapter_directory, chapter_number, merge_images_into_pdf, manifest
                     )
-
-                    start_ch_index = 0
-                    # Initialize with the total number of chapters
-                    end_ch_index = len(chapters)
-
-                    if start_ch is not None:
-                        for i, chapter in enumerate(chapters):
-                            chapter_number = self.utils.parse_chapter_number(
-                                chapter["href"]
-                            ) or self.utils.parse_chapter_number(chapter.text)
-                            if str(chapter_number) == start_ch:
-                                start_ch_index = i
-                                break
-                        else:
-                            self.logger.warning(
-                                "Chapter %s not found. Starting from the beginning.",
-                                start_ch,
-                            )
-
-                    if end_ch is not None:
-                        for i, chapter in enumerate(chapters):
-                            chapter_number = self.utils.parse_chapter_number(
-                                chapter["href"]
-                            ) or self.utils.parse_chapter_number(chapter.text)
-                            if str(chapter_number) == end_ch:
-                                end_ch_index = (
-                                    i + 1
-                                )  # +1 to include the end chapter in the slice
-                                break
-                        else:
-                            self.logger.warning(
-                                "Chapter %s not found. Downloading up to the last available chapter.",
-                                end_ch,
-                            )
-
-                    chapters = chapters[start_ch_index:end_ch_index]
-
-                    for chapter in chapters:
-                        chapter_number = self.utils.parse_chapter_number(
-                            chapter["href"]
-                        )
-                        chapter_directory = (
-                            f"./manga_downloads/{manga_title}/chapter_{chapter_number}"
-                        )
-                        if not chapter["href"].startswith("http"):
-                            if chapter["href"].startswith("/"):
-                                chapter["href"] = str(urllib.parse.urljoin(main_url, chapter["href"]))
-                        self.download_files(
-                            chapter["href"],
-                            chapter_number,
-                            chapter_directory,
+                    continue
+                for ahead in range(position, min(position + self.lookahead + 1, len(upcoming))):
+                    if ahead not in discoveries:
+                        discoveries[ahead] = self.prefetch_pool.submit(
+                            self.fetch_chapter_pages,
+                            upcoming[ahead][0],
                             chapter_page_selector,
-                            alternative_chapter_page_selector,
+                            alternative_page_selectors,
                         )
-                        if merge_images_into_pdf:
-                            self.utils.merge_images_to_pdf(
-                                chapter_directory, f"chapter_{chapter_number}"
-                            )
-                    self.logger.info("All done!")
+                started = time.perf_counter()
+                image_urls = discoveries.pop(position).result()
+                queued = self.queue_pages(
+                    chapter_url,
+                    chapter_number,
+                    chapter_directory,
+                    image_urls,
+                    manifest,
+                    started,
+                    position,
+                )
+                position += 1
+                in_flight.append((chapter, queued))
+                while len(in_flight) > self.lookahead:
+                    self.finish_next_chapter(in_flight, merge_images_into_pdf, manifest)
+        finally:
+            for discovery in discoveries.values():
+                discovery.cancel()
+            while in_flight:
+                self.finish_next_chapter(in_flight, merge_images_into_pdf, manifest)
+
+    def discover_chapters(
+        self, main_url, chapter_link_selector, start_ch, end_ch, manga_title, pagination=None
+    ):
+        # The selected chapters, oldest first; empty if the listing failed
+        self.logger.info("Getting Chapters from %s ...", main_url)
+        with self.metrics.timer("manga_stage_seconds", stage="listing"):
+            main_page_content = self.utils.make_request(main_url)
+            if not main_page_content:
+                return []
+            more_pages = []
+            if pagination is not None:
+                more_pages = self.fetch_listing_pages(
+                    main_url, main_page_content, chapter_link_selector, pagination
+                )
+        with self.metrics.profile("select_chapters"):
+            return self.select_chapters(
+                main_page_content,
+                chapter_link_selector,
+                start_ch,
+                end_ch,
+                manga_title,
+                main_url,
+                more_pages,
+            )
+
+    def use_plan(self, plan):
+        # A saved DownloadPlan stands in for chapter and page discovery
+        self.logger.info(
+            "Using the plan from %s: %s chapters", time.ctime(plan.created), len(plan.chapters)
+        )
+        self.planned_pages.update(plan.page_urls())
+        return plan.chapter_tuples()
+
+    def forget_plan(self, plan):
+        # Only this plan's chapters: another run may be using its own plan
+        for url in plan.page_urls():
+            self.planned_pages.pop(url, None)
+
+    def start_scraping(self, *args, sync=False, pagination=None, plan=None):
+        (
+            start_ch,
+            end_ch,
+            manga_title,
+            main_url,
+            chapter_page_selector,
+            chapter_link_selector,
+            alternative_chapter_page_selector,
+            merge_images_into_pdf,
+        ) = args
+
+        self.log_arguments(args)
+        self.metrics.set_labels(series=manga_title)
+
+        manifest = None
+        try:
+            manifest = Manifest.for_title(manga_title)
+            if plan is not None:
+                chapters = self.use_plan(plan)
+            else:
+                chapters = self.discover_chapters(
+                    main_url, chapter_link_selector, start_ch, end_ch, manga_title, pagination
+                )
+            if chapters:
+                pending = set(self.filter_chapters(chapters, manifest, sync))
+                self.report("series", title=manga_title, chapters=len(pending))
+                self.download_chapters(
+                    chapters,
+                    pending,
+                    chapter_page_selector,
+                    alternative_chapter_page_selector,
+                    merge_images_into_pdf,
+                    manifest,
+                )
+                self.merge_pool.wait(partial(self.record_transcodes, manifest), manifest)
+                self.utils.session.log_pool_stats()
+                self.log_cache_stats()
+                self.log_store_stats()
+                self.log_request_stats()
+                self.logger.info("All done!")
 
         except Exception as e:
             self.logger.error(
@@ -172,3 +767,10 @@ class MangaScraper:
                 e,
                 traceback.format_exc(),
             )
+        finally:
+            if plan is not None:
+                self.forget_plan(plan)
+            if manifest is not None:
+                manifest.close()
+            self.metrics.flush()
+            self.report("done", title=manga_title)
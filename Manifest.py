@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chapters (
+    url TEXT PRIMARY KEY,
+    number TEXT,
+    directory TEXT NOT NULL,
+    page_count INTEGER,
+    completed INTEGER NOT NULL DEFAULT 0,
+    first_seen REAL NOT NULL,
+    completed_at REAL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    chapter_url TEXT NOT NULL,
+    page_index INTEGER NOT NULL,
+    url TEXT,
+    path TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    original_size INTEGER,
+    completed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chapter_url, page_index)
+);
+"""
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pages)")}
+            if "original_size" not in columns:
+                # Manifests from before the transcode stage
+                self._conn.execute("ALTER TABLE pages ADD COLUMN original_size INTEGER")
+
+    @classmethod
+    def for_title(cls, manga_title, root="./manga_downloads"):
+        return cls(os.path.join(root, manga_title, "manifest.sqlite3"))
+
+    def known_chapter_urls(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT url FROM chapters").fetchall()
+        return {row[0] for row in rows}
+
+    def is_chapter_complete(self, chapter_url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT completed FROM chapters WHERE url = ?", (chapter_url,)
+            ).fetchone()
+            if not row or not row[0]:
+                return False
+            paths = self._conn.execute(
+                "SELECT path FROM pages WHERE chapter_url = ? AND url IS NOT NULL",
+                (chapter_url,),
+            ).fetchall()
+        # Trust the manifest only as long as the files are still on disk
+        return all(os.path.exists(path) for (path,) in paths)
+
+    def record_chapter(self, chapter_url, chapter_number, directory, pages):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO chapters (url, number, directory, page_count, first_seen) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET number = excluded.number, "
+                "directory = excluded.directory, page_count = excluded.page_count",
+                (chapter_url, str(chapter_number), directory, len(pages), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO pages (chapter_url, page_index, url, path) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(chapter_url, page_index) DO UPDATE SET "
+                "url = excluded.url, path = excluded.path, "
+                "size = NULL, sha256 = NULL, original_size = NULL, completed = 0 "
+                "WHERE pages.url IS NOT excluded.url",
+                [
+                    (chapter_url, index, page_url, path)
+                    for index, (page_url, path) in enumerate(pages)
+                ],
+            )
+
+    def completed_pages(self, chapter_url):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page_index FROM pages WHERE chapter_url = ? AND completed = 1",
+                (chapter_url,),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def record_page(self, chapter_url, page_index, path, size, sha256):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pages SET path = ?, size = ?, sha256 = ?, original_size = NULL, "
+                "completed = 1 WHERE chapter_url = ? AND page_index = ?",
+                (path, size, sha256, chapter_url, page_index),
+            )
+
+    def record_transcodes(self, pages):
+        # Transcoder results: pages may have moved to another extension and
+        # shrunk. original_size keeps the size as downloaded across passes.
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE pages SET path = ?, size = ?, sha256 = COALESCE(?, sha256), "
+                "original_size = COALESCE(original_size, ?) WHERE path = ?",
+                [
+                    (page.new_path, page.size, page.sha256, page.original_size, page.path)
+                    for page in pages
+                    if page.action in ("converted", "renamed")
+                ],
+            )
+
+    def complete_chapter(self, chapter_url):
+        with self._lock, self._conn:
+            pending = self._conn.execute(
+                "SELECT COUNT(*) FROM pages "
+                "WHERE chapter_url = ? AND url IS NOT NULL AND completed = 0",
+                (chapter_url,),
+            ).fetchone()[0]
+            if pending:
+                return False
+            self._conn.execute(
+                "UPDATE chapters SET completed = 1, completed_at = ? WHERE url = ?",
+                (time.time(), chapter_url),
+            )
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,286 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from a cached HTML hit up to a slow volume build
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Held while any cProfile section runs. From Python 3.12 cProfile hooks
+# the whole process through sys.monitoring and a second enable() raises.
+_profiler_lock = threading.Lock()
+
+
+def format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One slot per bucket plus the +Inf overflow
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    # Counters and latency histograms keyed by name and labels. Constant
+    # labels (such as the series being scraped) are added to every sample.
+    # Exports as Prometheus text, over HTTP with serve(), or as a JSON file.
+    def __init__(self, labels=None, buckets=DEFAULT_BUCKETS, json_path=None, profile_dir=None):
+        self.labels = dict(labels or {})
+        self.buckets = tuple(buckets)
+        self.json_path = json_path
+        # cProfile output for the sections wrapped in profile(), off if None
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._profiles = {}
+        self._server = None
+
+    def set_labels(self, **labels):
+        with self._lock:
+            self.labels.update(labels)
+
+    def _key(self, name, labels):
+        merged = {**self.labels, **labels}
+        return name, tuple(
+            sorted((key, str(value)) for key, value in merged.items() if value is not None)
+        )
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def profile(self, section):
+        # One profiler runs at a time in the process. A section that starts
+        # while another runs, nested or on another thread, is not profiled
+        # on its own; nested ones are folded into the running one.
+        if not self.profile_dir or not _profiler_lock.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Something outside this process' sections is already profiling
+            _profiler_lock.release()
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _profiler_lock.release()
+            with self._lock:
+                stats = self._profiles.get(section)
+                if stats is None:
+                    self._profiles[section] = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+
+    def counter_value(self, name, **labels):
+        # Sum over every series of `name` matching `labels`
+        wanted = {(key, str(value)) for key, value in labels.items()}
+        with self._lock:
+            return sum(
+                value
+                for (counter, key), value in self._counters.items()
+                if counter == name and wanted.issubset(key)
+            )
+
+    def histograms(self, name):
+        # (labels, histogram) for every series of `name`
+        with self._lock:
+            return [
+                (dict(labels), histogram)
+                for (histogram_name, labels), histogram in self._histograms.items()
+                if histogram_name == name
+            ]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "buckets": list(self.buckets),
+                        "counts": list(histogram.counts),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                    }
+                    for (name, labels), histogram in sorted(self._histograms.items())
+                ],
+            }
+
+    def to_prometheus(self):
+        lines = []
+        typed = set()
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    le = format_labels(labels, (("le", bound),))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path=None):
+        path = path or self.json_path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def dump_profiles(self, directory=None):
+        directory = directory or self.profile_dir
+        with self._lock:
+            profiles = dict(self._profiles)
+        if not profiles:
+            return []
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for section, stats in profiles.items():
+            path = os.path.join(directory, f"{section}.prof")
+            stats.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def flush(self):
+        # Writes whatever exports are configured; a no-op otherwise
+        if self.json_path:
+            self.write_json()
+        if self.profile_dir:
+            self.dump_profiles()
+
+    def serve(self, port=9464, host="127.0.0.1"):
+        self._server = serve_metrics(lambda: self, port, host)
+        return self._server.server_address[1]
+
+    @classmethod
+    def merged(cls, sources, buckets=DEFAULT_BUCKETS):
+        # One Metrics holding the samples of all `sources`, e.g. one per
+        # series, for a single export. Samples with the same labels add up;
+        # all sources need the same histogram buckets.
+        combined = cls(buckets=buckets)
+        for source in sources:
+            with source._lock:
+                counters = dict(source._counters)
+                histograms = {
+                    key: (list(histogram.counts), histogram.count, histogram.sum)
+                    for key, histogram in source._histograms.items()
+                }
+            for key, value in counters.items():
+                combined._counters[key] = combined._counters.get(key, 0) + value
+            for key, (counts, count, total) in histograms.items():
+                histogram = combined._histograms.get(key)
+                if histogram is None:
+                    histogram = combined._histograms[key] = Histogram(combined.buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.sum += total
+        return combined
+
+    def stop_serving(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def serve_metrics(source, port=9464, host="127.0.0.1"):
+    # Prometheus scrape endpoint at /metrics, JSON at /metrics.json, for the
+    # Metrics that `source()` returns at the time of each request
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = source().to_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(source().snapshot()).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,226 @@
+import hashlib
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def synthetic_jpeg(seed, size, width=800, height=1200):
+    # A JPEG header with a valid frame header, padded with comment segments
+    # to `size` bytes. Enough for the PDF passthrough, which never decodes it.
+    header = b"\xff\xd8\xff\xe0" + struct.pack(">H", 16)
+    header += b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    header += b"\xff\xc0" + struct.pack(">HBHHB", 17, 8, height, width, 3)
+    header += b"\x01\x22\x00\x02\x11\x01\x03\x11\x01"
+    body = bytearray(header)
+    rng = random.Random(seed)
+    remaining = max(size - len(body) - 2, 0)
+    while remaining > 4:
+        chunk = min(remaining - 4, 65533)
+        body += b"\xff\xfe" + struct.pack(">H", chunk + 2) + rng.randbytes(chunk)
+        remaining -= chunk + 4
+    body += b"\xff\xd9"
+    return bytes(body)
+
+
+class MockMangaSite:
+    # A local stand-in for a manga site: a series page listing chapters,
+    # chapter pages with lazy-loaded <img> tags and images of a fixed size.
+    # Latency, throttling/server errors and a bandwidth cap are configurable.
+    def __init__(
+        self,
+        chapters=5,
+        pages_per_chapter=20,
+        image_size=200 * 1024,
+        latency=0.0,
+        error_rate=0.0,
+        error_statuses=(429, 503),
+        bandwidth=None,
+        host="127.0.0.1",
+        port=0,
+        chapters_per_listing=None,
+    ):
+        self.chapters = chapters
+        # Splits the chapter list over /series/?page=N listing pages
+        self.chapters_per_listing = chapters_per_listing
+        self.pages_per_chapter = pages_per_chapter
+        self.image_size = image_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        # Bytes per second per response, None for unlimited
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._images = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def series_url(self):
+        return f"{self.base_url}/series/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def listing_pages(self):
+        if not self.chapters_per_listing:
+            return 1
+        return max(-(-self.chapters // self.chapters_per_listing), 1)
+
+    def series_page(self, page=1):
+        # Newest first. Paginated listings link the two pages on either side
+        # and the next one, like most pagination widgets.
+        newest = self.chapters
+        pagination = ""
+        if self.chapters_per_listing:
+            newest = self.chapters - (page - 1) * self.chapters_per_listing
+            oldest = max(newest - self.chapters_per_listing, 0)
+            nearby = range(max(page - 2, 1), min(page + 2, self.listing_pages()) + 1)
+            pagination = "".join(f'<a href="/series/?page={n}">{n}</a>' for n in nearby)
+            if page < self.listing_pages():
+                pagination += f'<a class="next" href="/series/?page={page + 1}">Next</a>'
+        else:
+            oldest = 0
+        links = [
+            f'<li><a class="chapter-link" href="/series/chapter-{n}/">Chapter {n}</a></li>'
+            for n in range(newest, oldest, -1)
+        ]
+        return (
+            f"<html><body><ul class=\"chapters\">{''.join(links)}</ul>"
+            f'<div class="pagination">{pagination}</div></body></html>'
+        )
+
+    def chapter_page(self, chapter):
+        # Odd chapters lazy-load through data-lazy-src, even ones through data-src
+        attribute = "data-lazy-src" if chapter % 2 else "data-src"
+        images = [
+            f'<img class="page" src="/static/loading.gif" '
+            f'{attribute}="{self.base_url}/images/{chapter}/{page}.jpg">'
+            for page in range(self.pages_per_chapter)
+        ]
+        return f"<html><body><div class=\"reader\">{''.join(images)}</div></body></html>"
+
+    def image(self, chapter, page):
+        key = (chapter, page)
+        with self._lock:
+            data = self._images.get(key)
+            if data is None:
+                data = synthetic_jpeg(f"{chapter}/{page}", self.image_size)
+                self._images[key] = data
+        return data
+
+    def route(self, path):
+        path, _, query = path.partition("?")
+        parts = [part for part in path.split("/") if part]
+        if parts == ["series"]:
+            page = int(query[len("page=") :]) if query.startswith("page=") else 1
+            if 1 <= page <= self.listing_pages():
+                return "text/html", self.series_page(page).encode("utf-8")
+        if len(parts) == 2 and parts[0] == "series" and parts[1].startswith("chapter-"):
+            chapter = int(parts[1][len("chapter-") :])
+            if 1 <= chapter <= self.chapters:
+                return "text/html", self.chapter_page(chapter).encode("utf-8")
+        if len(parts) == 3 and parts[0] == "images":
+            chapter, page = int(parts[1]), int(parts[2].split(".")[0])
+            if 1 <= chapter <= self.chapters and 0 <= page < self.pages_per_chapter:
+                return "image/jpeg", self.image(chapter, page)
+        return None, None
+
+    def _handler_class(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=None, send_body=True):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if not send_body:
+                    return
+                chunk_size = 64 * 1024
+                for start in range(0, len(body), chunk_size):
+                    chunk = body[start : start + chunk_size]
+                    self.wfile.write(chunk)
+                    if site.bandwidth:
+                        time.sleep(len(chunk) / site.bandwidth)
+                with site._lock:
+                    site.bytes_sent += len(body)
+
+            def _serve(self, send_body):
+                with site._lock:
+                    site.requests += 1
+                if site.latency:
+                    time.sleep(site.latency)
+                if site.error_rate and random.random() < site.error_rate:
+                    with site._lock:
+                        site.errors += 1
+                    status = random.choice(site.error_statuses)
+                    self._send(status, b"", {"Retry-After": "1"}, send_body)
+                    return
+
+                content_type, body = site.route(self.path)
+                if body is None:
+                    self._send(404, b"", None, send_body)
+                    return
+
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                headers = {"Content-Type": content_type, "ETag": etag}
+                if content_type == "text/html":
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self._send(200, body, headers, send_body)
+                    return
+
+                headers["Accept-Ranges"] = "bytes"
+                requested = self.headers.get("Range", "")
+                if requested.startswith("bytes=") and requested.endswith("-"):
+                    start = int(requested[len("bytes=") : -1])
+                    if start >= len(body):
+                        self._send(
+                            416, b"", {"Content-Range": f"bytes */{len(body)}"}, send_body
+                        )
+                        return
+                    headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+                    self._send(206, body[start:], headers, send_body)
+                    return
+                self._send(200, body, headers, send_body)
+
+            def do_GET(self):
+                self._serve(True)
+
+            def do_HEAD(self):
+                self._serve(False)
+
+        return Handler
@@ -0,0 +1,212 @@
+import hashlib
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from Utils import Utils
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+"""
+# A staging claim older than this is taken to be left by a dead process
+STALE_CLAIM_SECONDS = 3600
+
+
+class PageStore:
+    # Content-addressed store for page images. Every distinct image is kept
+    # once under blobs/<2 hex>/<sha256> and hardlinked into the chapter
+    # directories; a URL index means a known URL is never fetched again.
+    # Pages that share a URL, such as a banner on every chapter, are fetched
+    # once even when their chapters download at the same time.
+    def __init__(self, root="./manga_downloads/.store"):
+        self.root = root
+        self.blobs_path = os.path.join(root, "blobs")
+        self.staging_root = os.path.join(root, "staging")
+        for path in (self.blobs_path, self.staging_root):
+            if not os.path.exists(path):
+                os.makedirs(path, exist_ok=True)
+        self.url_hits = 0
+        self.content_hits = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        # URL -> Future of the download running for it in this process, set
+        # to its sha256 or None
+        self._downloads = {}
+        self._conn = sqlite3.connect(
+            os.path.join(root, "index.sqlite3"), check_same_thread=False, timeout=30
+        )
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_path, sha256[:2], sha256)
+
+    def staging_path(self, url):
+        # Stable per URL so an interrupted download resumes from its .part
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.staging_root, f"{name}.download")
+
+    def claim_staging(self, url):
+        # (staging path, claim) for downloading `url`. Processes and machines
+        # sharing the store claim the stable path with an O_EXCL claim file;
+        # when another one holds it, this one downloads to a private path
+        # instead of racing it on the same .part file.
+        path = self.staging_path(url)
+        claim = f"{path}.claim"
+        for _ in range(2):
+            try:
+                os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path, claim
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(claim)
+                except OSError:
+                    # Released in the meantime
+                    continue
+                if age < STALE_CLAIM_SECONDS:
+                    break
+                try:
+                    os.remove(claim)
+                except OSError:
+                    pass
+        return f"{path}.{socket.gethostname()}.{os.getpid()}", None
+
+    @staticmethod
+    def release_staging(staged_path, claim):
+        if claim is not None:
+            try:
+                os.remove(claim)
+            except OSError:
+                pass
+        elif os.path.exists(f"{staged_path}.part"):
+            # A private download cannot be resumed by anyone, drop what is left
+            os.remove(f"{staged_path}.part")
+
+    @staticmethod
+    def link(blob_path, page_path):
+        tmp_path = f"{page_path}.link"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            # Other filesystem or no hardlink support
+            shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, page_path)
+
+    def link_known(self, url, page_path):
+        # Links the stored image for `url` into place and returns its hash, or
+        # returns None if the URL has not been seen or its blob is gone.
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT urls.sha256, blobs.size FROM urls "
+                "JOIN blobs ON blobs.sha256 = urls.sha256 WHERE urls.url = ?",
+                (url,),
+            ).fetchone()
+        if not row or not os.path.exists(self.blob_path(row[0])):
+            return None
+        self.link(self.blob_path(row[0]), page_path)
+        with self._lock:
+            self.url_hits += 1
+            self.bytes_saved += row[1]
+        return row[0]
+
+    def known_size(self, url):
+        # Size of the stored image for `url`, or None if it would be fetched
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT urls.sha256, blobs.size FROM urls "
+                "JOIN blobs ON blobs.sha256 = urls.sha256 WHERE urls.url = ?",
+                (url,),
+            ).fetchone()
+        if not row or not os.path.exists(self.blob_path(row[0])):
+            return None
+        return row[1]
+
+    def commit(self, url, staged_path, page_path):
+        # Moves a finished download into the store, or drops it if the same
+        # bytes are already stored under another URL, then links it in.
+        sha256 = Utils.hash_file(staged_path)
+        size = os.path.getsize(staged_path)
+        blob_path = self.blob_path(sha256)
+        if os.path.exists(blob_path):
+            os.remove(staged_path)
+            with self._lock:
+                self.content_hits += 1
+                self.bytes_saved += size
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(staged_path, blob_path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, size) VALUES (?, ?)",
+                (sha256, size),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO urls (url, sha256) VALUES (?, ?)", (url, sha256)
+            )
+        self.link(blob_path, page_path)
+        return sha256
+
+    def begin_download(self, url):
+        # None when the caller is to download `url` and call end_download,
+        # else the Future of the download already running for it
+        with self._lock:
+            running = self._downloads.get(url)
+            if running is None:
+                self._downloads[url] = Future()
+            return running
+
+    def end_download(self, url, sha256):
+        with self._lock:
+            running = self._downloads.pop(url)
+        running.set_result(sha256)
+
+    def fetch(self, utils, url, page_path):
+        sha256 = self.link_known(url, page_path)
+        while sha256 is None:
+            running = self.begin_download(url)
+            if running is None:
+                break
+            if running.result() is None:
+                # Already failed for another page, do not try it again
+                return None
+            sha256 = self.link_known(url, page_path)
+        else:
+            return sha256
+        try:
+            # It may have been stored between the first check and the claim
+            sha256 = self.link_known(url, page_path)
+            if sha256 is None:
+                staged_path, claim = self.claim_staging(url)
+                try:
+                    if utils.download_file(url, staged_path) is not None:
+                        sha256 = self.commit(url, staged_path, page_path)
+                finally:
+                    self.release_staging(staged_path, claim)
+        finally:
+            self.end_download(url, sha256)
+        return sha256
+
+    def stats(self):
+        with self._lock:
+            return {
+                "url_hits": self.url_hits,
+                "content_hits": self.content_hits,
+                "bytes_saved": self.bytes_saved,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,197 @@
+import os
+import shutil
+import struct
+import zlib
+from PIL import Image
+
+# Baseline, extended and progressive Huffman JPEGs; DCTDecode in PDF readers
+# does not cover lossless or arithmetic-coded variants.
+PASSTHROUGH_SOF_MARKERS = (0xC0, 0xC1, 0xC2)
+STANDALONE_MARKERS = (0x01, 0xD8, *range(0xD0, 0xD8))
+COLOR_SPACES = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}
+
+
+def read_jpeg_info(path):
+    # Walks the marker segments up to the frame header. Returns
+    # (width, height, components, adobe) or None if the file is not a JPEG
+    # that can be embedded as-is.
+    adobe = False
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            if byte != b"\xff":
+                continue
+            marker = f.read(1)
+            while marker == b"\xff":
+                marker = f.read(1)
+            if not marker:
+                return None
+            marker = marker[0]
+            if marker in STANDALONE_MARKERS:
+                continue
+            if marker in (0xD9, 0xDA):
+                # End of image or start of scan before any frame header
+                return None
+            length_bytes = f.read(2)
+            if len(length_bytes) != 2:
+                return None
+            length = struct.unpack(">H", length_bytes)[0]
+            segment = f.read(length - 2)
+            if len(segment) != length - 2:
+                return None
+            if marker == 0xEE and segment.startswith(b"Adobe"):
+                adobe = True
+            elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                if marker not in PASSTHROUGH_SOF_MARKERS:
+                    return None
+                precision, height, width, components = struct.unpack(
+                    ">BHHB", segment[:6]
+                )
+                if precision != 8 or components not in COLOR_SPACES:
+                    return None
+                return width, height, components, adobe
+
+
+class StreamingPdfWriter:
+    # Writes one page at a time straight to disk: JPEG files are copied in as
+    # DCTDecode streams, anything else is decoded once and stored losslessly
+    # with FlateDecode. Only the current page is ever held in memory.
+    def __init__(self, path, chunk_size=1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.page_count = 0
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._offsets = {}
+        self._page_ids = []
+        # 1 is the catalog and 2 the page tree, both written on close
+        self._next_id = 3
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _reserve(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _begin(self, obj_id):
+        self._offsets[obj_id] = self._file.tell()
+        self._file.write(f"{obj_id} 0 obj\n".encode("ascii"))
+
+    def _write_object(self, obj_id, body):
+        self._begin(obj_id)
+        self._file.write(body.encode("ascii"))
+        self._file.write(b"\nendobj\n")
+
+    def _write_stream(self, obj_id, dictionary, data=None, source=None, length=None):
+        self._begin(obj_id)
+        self._file.write(
+            f"<< {dictionary} /Length {length if data is None else len(data)} >>\n"
+            "stream\n".encode("ascii")
+        )
+        if data is not None:
+            self._file.write(data)
+        else:
+            shutil.copyfileobj(source, self._file, self.chunk_size)
+        self._file.write(b"\nendstream\nendobj\n")
+
+    def _add_jpeg(self, image_id, image_path, info):
+        width, height, components, adobe = info
+        dictionary = (
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {COLOR_SPACES[components]} /BitsPerComponent 8 "
+            "/Filter /DCTDecode"
+        )
+        if components == 4 and adobe:
+            # Adobe writes CMYK JPEGs inverted
+            dictionary += " /Decode [1 0 1 0 1 0 1 0]"
+        with open(image_path, "rb") as source:
+            self._write_stream(
+                image_id, dictionary, source=source, length=os.path.getsize(image_path)
+            )
+        return width, height
+
+    def _add_decoded(self, image_id, image_path):
+        with Image.open(image_path) as image:
+            if image.mode not in ("L", "RGB"):
+                image = image.convert("L" if image.mode in ("1", "LA") else "RGB")
+            width, height = image.size
+            color_space = "/DeviceGray" if image.mode == "L" else "/DeviceRGB"
+            data = zlib.compress(image.tobytes(), 6)
+        dictionary = (
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode"
+        )
+        self._write_stream(image_id, dictionary, data=data)
+        return width, height
+
+    def add_image(self, image_path):
+        image_id = self._reserve()
+        info = read_jpeg_info(image_path)
+        if info is not None:
+            width, height = self._add_jpeg(image_id, image_path, info)
+        else:
+            width, height = self._add_decoded(image_id, image_path)
+
+        # One pixel per point, the same page size PIL produces at 72 dpi
+        content_id = self._reserve()
+        self._write_stream(
+            content_id,
+            "",
+            data=f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode("ascii"),
+        )
+        page_id = self._reserve()
+        self._write_object(
+            page_id,
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+            f"/Contents {content_id} 0 R >>",
+        )
+        self._page_ids.append(page_id)
+        self.page_count += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        if not self._page_ids:
+            self.abort()
+            return
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+        self._write_object(
+            2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>"
+        )
+        xref_offset = self._file.tell()
+        self._file.write(f"xref\n0 {self._next_id}\n".encode("ascii"))
+        self._file.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, self._next_id):
+            if obj_id in self._offsets:
+                entry = f"{self._offsets[obj_id]:010d} 00000 n \n"
+            else:
+                # Reserved for an image that failed to load
+                entry = "0000000000 65535 f \n"
+            self._file.write(entry.encode("ascii"))
+        self._file.write(
+            f"trailer\n<< /Size {self._next_id} /Root 1 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n".encode("ascii")
+        )
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
@@ -0,0 +1,79 @@
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _timed_merge(merge_fn, chapter_path, pdf_name, options):
+    started = time.perf_counter()
+    result = merge_fn(chapter_path, pdf_name, **options)
+    return time.perf_counter() - started, result
+
+
+class PdfMergePool:
+    # Runs chapter PDF builds in worker processes so they use every core and
+    # overlap with downloading the next chapters. Several runs can share one
+    # pool: each passes its own `group` and waits only for its own builds.
+    def __init__(self, logger, merge_fn, max_workers=None, metrics=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.merge_fn = merge_fn
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.metrics = metrics
+        self._executor = None
+        self._lock = threading.Lock()
+        # group -> (time of its first submit, [(pdf_name, future)])
+        self._pending = {}
+
+    def submit(self, chapter_path, pdf_name, group=None, **options):
+        # `options` are passed on to merge_fn
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            future = self._executor.submit(
+                _timed_merge, self.merge_fn, chapter_path, pdf_name, options
+            )
+            if group not in self._pending:
+                self._pending[group] = (time.perf_counter(), [])
+            self._pending[group][1].append((pdf_name, future))
+        return future
+
+    def wait(self, on_result=None, group=None):
+        # on_result(pdf_name, result) is called with whatever merge_fn
+        # returned, for the builds that returned something
+        with self._lock:
+            started, pending = self._pending.pop(group, (None, []))
+        timings = {}
+        for pdf_name, future in pending:
+            try:
+                timings[pdf_name], result = future.result()
+                if on_result is not None and result:
+                    on_result(pdf_name, result)
+                self.logger.info("Built %s in %.2fs", pdf_name, timings[pdf_name])
+                if self.metrics is not None:
+                    self.metrics.observe("manga_stage_seconds", timings[pdf_name], stage="pdf")
+            except Exception as e:
+                if self.metrics is not None:
+                    self.metrics.inc("manga_stage_failures_total", stage="pdf")
+                self.logger.error(
+                    "Error building %s.pdf: %s\n%s",
+                    pdf_name,
+                    e,
+                    traceback.format_exc(),
+                )
+        if timings:
+            self.logger.info(
+                "Built %s chapters (%.2fs of work) in %.2fs on %s workers",
+                len(timings),
+                sum(timings.values()),
+                time.perf_counter() - started,
+                self.max_workers,
+            )
+        return timings
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
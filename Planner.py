@@ -0,0 +1,270 @@
+import json
+import os
+import shutil
+import statistics
+import threading
+import time
+from collections import Counter
+from DownloadPool import DownloadPool
+
+
+class OverBudget(Exception):
+    pass
+
+
+def free_disk_space(path):
+    # Free bytes on the filesystem `path` is or will be created on
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+
+def plan_path(manga_title, root="./manga_downloads"):
+    return os.path.join(root, manga_title, "plan.json")
+
+
+class DownloadPlan:
+    # What a run will fetch, found without downloading any page: the pending
+    # chapters with their page URLs and sizes. Saved as JSON so the real run
+    # can start downloading straight away. Page URLs that expire (signed CDN
+    # links) make a plan go stale, so it is best executed soon after.
+    def __init__(self, title, args, chapters, created=None, estimate=None):
+        self.title = title
+        # start_scraping's positional arguments
+        self.args = list(args)
+        # One dict per chapter: url, number, directory and pages, a list of
+        # [image_url, bytes to download or None if unknown]
+        self.chapters = chapters
+        self.created = created or time.time()
+        self.estimate = estimate or {}
+
+    def chapter_tuples(self):
+        return [
+            (chapter["url"], chapter["number"], chapter["directory"])
+            for chapter in self.chapters
+        ]
+
+    def page_urls(self):
+        return {
+            chapter["url"]: [image_url for image_url, _ in chapter["pages"]]
+            for chapter in self.chapters
+        }
+
+    def to_json(self):
+        return {
+            "title": self.title,
+            "args": self.args,
+            "created": self.created,
+            "estimate": self.estimate,
+            "chapters": self.chapters,
+        }
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["title"], data["args"], data["chapters"], data["created"], data["estimate"])
+
+
+class Budget:
+    # Limits shared by every plan checked against it. Disk and transfer
+    # bytes granted to one plan are taken off what the next one may use;
+    # the time limit applies to each plan on its own, since series run side
+    # by side. A disk limit of None means the free space at `root`.
+    def __init__(
+        self, disk_bytes=None, transfer_bytes=None, seconds=None, root="./manga_downloads"
+    ):
+        self.disk_bytes = disk_bytes if disk_bytes is not None else free_disk_space(root)
+        self.transfer_bytes = transfer_bytes
+        self.seconds = seconds
+        self._lock = threading.Lock()
+
+    def fits(self, disk_bytes, transfer_bytes, seconds):
+        if disk_bytes > self.disk_bytes:
+            return False
+        if self.transfer_bytes is not None and transfer_bytes > self.transfer_bytes:
+            return False
+        return self.seconds is None or seconds <= self.seconds
+
+    def reserve(self, totals, trim=False):
+        # How many of the chapters with these running (transfer bytes, disk
+        # bytes, seconds) totals fit, taking their bytes off the budget.
+        # Without `trim` it is all of them or OverBudget.
+        with self._lock:
+            count = len(totals)
+            while count and not self.fits(*totals[count - 1]):
+                count -= 1
+            if count < len(totals) and (not trim or count == 0):
+                transfer_bytes, disk_bytes, seconds = totals[-1]
+                raise OverBudget(
+                    f"Needs {disk_bytes / 1024 / 1024:.1f} MB of disk, "
+                    f"{transfer_bytes / 1024 / 1024:.1f} MB of transfer and about "
+                    f"{seconds / 3600:.2f} h, over the budget of {self.describe()}"
+                )
+            if count:
+                transfer_bytes, disk_bytes, _ = totals[count - 1]
+                self.disk_bytes -= disk_bytes
+                if self.transfer_bytes is not None:
+                    self.transfer_bytes -= transfer_bytes
+        return count
+
+    def describe(self):
+        limits = [f"{self.disk_bytes / 1024 / 1024:.1f} MB of disk"]
+        if self.transfer_bytes is not None:
+            limits.append(f"{self.transfer_bytes / 1024 / 1024:.1f} MB of transfer")
+        if self.seconds is not None:
+            limits.append(f"{self.seconds / 3600:.2f} h")
+        return ", ".join(limits)
+
+
+class Planner:
+    # Dry run of MangaScraper.start_scraping: discovers the pending chapters
+    # and their pages, then asks for every page's size with HEAD requests
+    # sent through the scraper's download pool, so they are concurrent but
+    # within its per-host limit and the rate limiter. Pages already on disk
+    # or in the page store cost nothing; pages whose size the server does
+    # not give are counted at the median of the known ones.
+    def __init__(self, scraper, budget=None, trim=False):
+        self.scraper = scraper
+        self.logger = scraper.logger
+        self.budget = budget
+        # Over budget: drop the newest chapters rather than refuse
+        self.trim = trim
+
+    def discover(self, args, sync=False, pagination=None, manifest=None):
+        # (chapter, image_urls) for each pending chapter, oldest first
+        start_ch, end_ch, manga_title, main_url, page_selector, link_selector, alts, _ = args
+        scraper = self.scraper
+        chapters = scraper.discover_chapters(
+            main_url, link_selector, start_ch, end_ch, manga_title, pagination
+        )
+        if manifest is not None:
+            chapters = scraper.filter_chapters(chapters, manifest, sync)
+        futures = [
+            scraper.download_pool.submit(
+                chapter[0], scraper.fetch_chapter_pages, chapter[0], page_selector, alts
+            )
+            for chapter in chapters
+        ]
+        discovered = []
+        for chapter, future in zip(chapters, futures):
+            image_urls = future.result()
+            if image_urls is None:
+                self.logger.warning("Could not list the pages of chapter %s", chapter[1])
+                continue
+            discovered.append((chapter, image_urls))
+        return discovered
+
+    def page_cost(self, directory, index, image_url):
+        # Bytes the page will take to download: 0 when it is already local,
+        # None until it has been probed
+        if not image_url or self.scraper.existing_page_path(directory, index):
+            return 0
+        if self.scraper.page_store.known_size(image_url) is not None:
+            return 0
+        return None
+
+    def probe(self, discovered):
+        scraper = self.scraper
+        futures = {}
+        chapters = []
+        for position, ((url, number, directory), image_urls) in enumerate(discovered):
+            pages = []
+            for index, image_url in enumerate(image_urls):
+                cost = self.page_cost(directory, index, image_url)
+                if cost is None:
+                    futures[(position, index)] = scraper.download_pool.submit(
+                        image_url, scraper.utils.probe_size, image_url, priority=(position, index)
+                    )
+                pages.append([image_url, cost])
+            chapters.append({"url": url, "number": number, "directory": directory, "pages": pages})
+        self.logger.info("Probing the size of %s pages", len(futures))
+        for (position, index), future in futures.items():
+            chapters[position]["pages"][index][1] = future.result()
+        return chapters
+
+    def estimate(self, chapters, merge_images_into_pdf):
+        # Running (transfer bytes, disk bytes, seconds) totals per chapter,
+        # so a plan can be cut after any chapter
+        known = [size for chapter in chapters for _, size in chapter["pages"] if size]
+        fallback = statistics.median(known) if known else 0
+        # Packaging writes each chapter again per format, at about the size
+        # of its images
+        disk_factor = 1 + (len(self.scraper.package_formats) if merge_images_into_pdf else 0)
+        rate_limiter = self.scraper.utils.rate_limiter
+        bandwidth = self.scraper.utils.bandwidth
+        requests_per_host = Counter()
+        host_urls = {}
+        transfer_bytes = 0
+        totals = []
+        for chapter in chapters:
+            for image_url, size in chapter["pages"]:
+                if size == 0:
+                    continue
+                transfer_bytes += fallback if size is None else size
+                host = DownloadPool.host_of(image_url)
+                requests_per_host[host] += 1
+                host_urls.setdefault(host, image_url)
+            # Hosts are downloaded from side by side, each at its rate limit
+            seconds = max(
+                (
+                    count / rate_limiter.current_rate(host_urls[host])
+                    for host, count in requests_per_host.items()
+                ),
+                default=0.0,
+            )
+            if bandwidth is not None:
+                seconds = max(seconds, transfer_bytes / bandwidth.rate)
+            totals.append((transfer_bytes, transfer_bytes * disk_factor, seconds))
+        return totals
+
+    def plan(self, args, sync=False, pagination=None, manifest=None):
+        # Raises OverBudget when the plan does not fit and trimming is off
+        started = time.perf_counter()
+        chapters = self.probe(self.discover(args, sync, pagination, manifest))
+        totals = self.estimate(chapters, args[7])
+        count = len(chapters)
+        if self.budget is not None:
+            count = self.budget.reserve(totals, self.trim)
+        if count < len(chapters):
+            self.logger.warning(
+                "Over budget, planning chapters %s to %s and leaving out %s to %s",
+                chapters[0]["number"],
+                chapters[count - 1]["number"],
+                chapters[count]["number"],
+                chapters[-1]["number"],
+            )
+            chapters = chapters[:count]
+        transfer_bytes, disk_bytes, seconds = totals[count - 1] if count else (0, 0, 0.0)
+        sizes = [size for chapter in chapters for _, size in chapter["pages"]]
+        unknown = sizes.count(None)
+        estimate = {
+            "pages": len(sizes),
+            "unknown_sizes": unknown,
+            "transfer_bytes": transfer_bytes,
+            "disk_bytes": disk_bytes,
+            "seconds": seconds,
+            "planning_seconds": time.perf_counter() - started,
+        }
+        self.logger.info(
+            "Plan for %s: %s chapters, %s pages, %.1f MB to download (%s sizes guessed), "
+            "%.1f MB on disk, about %.0f s",
+            args[2],
+            len(chapters),
+            estimate["pages"],
+            transfer_bytes / 1024 / 1024,
+            unknown,
+            disk_bytes / 1024 / 1024,
+            seconds,
+        )
+        return DownloadPlan(args[2], args, chapters, estimate=estimate)
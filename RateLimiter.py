@@ -0,0 +1,183 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from random import uniform
+from urllib.parse import urlparse
+
+THROTTLE_STATUSES = (429, 503)
+
+
+class HostBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        logger,
+        rate=1.0,
+        burst=4,
+        min_rate=0.2,
+        max_rate=8.0,
+        increase_step=0.1,
+        decrease_factor=0.5,
+        error_decrease_factor=0.8,
+        backoff_base=1.0,
+        backoff_cap=60.0,
+    ):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        # A starting rate above the cap would drop to it on the first success
+        self.max_rate = max(max_rate, rate)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        # Server errors and failed connections are not a request to back off
+        # like 429/503, but a host producing them is often overloaded too
+        self.error_decrease_factor = error_decrease_factor
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host_of(url):
+        return urlparse(url).netloc.lower()
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = HostBucket(self.rate, self.burst)
+            self._buckets[host] = bucket
+        return bucket
+
+    @staticmethod
+    def _refill(bucket, now):
+        elapsed = now - bucket.updated
+        bucket.tokens = min(bucket.capacity, bucket.tokens + elapsed * bucket.rate)
+        bucket.updated = now
+
+    def reserve(self, url):
+        # Takes a token now, going into debt if needed, and returns how long
+        # the caller has to wait before using it. Callers that cannot block a
+        # thread (the asyncio engine) sleep on the returned delay themselves.
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(self.host_of(url))
+            self._refill(bucket, now)
+            bucket.tokens -= 1
+            delay = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+            return max(delay, bucket.blocked_until - now, 0.0)
+
+    def current_rate(self, url):
+        # Requests per second currently allowed for the host of `url`
+        with self._lock:
+            bucket = self._buckets.get(self.host_of(url))
+            return bucket.rate if bucket is not None else self.rate
+
+    def acquire(self, url):
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def record_success(self, url):
+        with self._lock:
+            bucket = self._bucket(self.host_of(url))
+            bucket.successes += 1
+            bucket.rate = min(self.max_rate, bucket.rate + self.increase_step)
+
+    def record_failure(self, url, attempt, status=None, retry_after=None):
+        # Returns how long this request should wait before its next attempt.
+        delay = uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+        retry_after = self.parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_cap))
+
+        host = self.host_of(url)
+        with self._lock:
+            bucket = self._bucket(host)
+            bucket.failures += 1
+            if status in THROTTLE_STATUSES or retry_after is not None:
+                bucket.rate = max(self.min_rate, bucket.rate * self.decrease_factor)
+                bucket.tokens = min(bucket.tokens, 0)
+                bucket.blocked_until = max(
+                    bucket.blocked_until, time.monotonic() + delay
+                )
+                if self.logger:
+                    self.logger.warning(
+                        "Host %s is throttling (HTTP %s). Slowing down to %.2f req/s",
+                        host,
+                        status,
+                        bucket.rate,
+                    )
+            elif status is None or status >= 500:
+                bucket.rate = max(self.min_rate, bucket.rate * self.error_decrease_factor)
+                if self.logger:
+                    self.logger.warning(
+                        "Host %s is failing (%s). Slowing down to %.2f req/s",
+                        host,
+                        f"HTTP {status}" if status else "no response",
+                        bucket.rate,
+                    )
+        return delay
+
+    @staticmethod
+    def parse_retry_after(value):
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except (TypeError, ValueError):
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if retry_at is None:
+            return None
+        return max(retry_at.timestamp() - time.time(), 0.0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                host: {
+                    "rate": bucket.rate,
+                    "successes": bucket.successes,
+                    "failures": bucket.failures,
+                }
+                for host, bucket in self._buckets.items()
+            }
+
+
+class BandwidthLimiter:
+    # One byte budget shared by every download, whatever the host. Same debt
+    # model as RateLimiter.reserve: take the bytes just received and wait
+    # until the bucket is back to zero.
+    def __init__(self, bytes_per_second, burst=None):
+        self.rate = bytes_per_second
+        self.capacity = burst or bytes_per_second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        now = time.monotonic()
+        with self._lock:
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+            self.tokens -= size
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def consume(self, size):
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
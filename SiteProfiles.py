@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+from urllib.parse import urlparse
+
+IMAGE_ATTRIBUTES = ("src", "data-lazy-src", "data-src")
+
+
+class SiteProfiles:
+    # Remembers, per host, which page selector and image attribute last worked
+    # so later chapters try them first. Profiles live in a JSON file that can
+    # be copied between machines or merged with merge_file().
+    def __init__(self, path="./manga_downloads/site_profiles.json"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._profiles = {}
+        if path and os.path.exists(path):
+            self._profiles = self._read(path)
+
+    @staticmethod
+    def host_of(url):
+        return urlparse(url).netloc.lower()
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return profiles if isinstance(profiles, dict) else {}
+
+    def get(self, host):
+        with self._lock:
+            return dict(self._profiles.get(host, {}))
+
+    def selector_order(self, host, selectors):
+        # Only reorders `selectors`: profiles are per host, so the selector
+        # learned from another series on the same site may not be one this
+        # series was configured with
+        learned = self.get(host).get("page_selector")
+        if learned not in selectors:
+            return list(selectors)
+        return [learned, *(selector for selector in selectors if selector != learned)]
+
+    def attribute_order(self, host):
+        learned = self.get(host).get("image_attribute")
+        if learned not in IMAGE_ATTRIBUTES:
+            return IMAGE_ATTRIBUTES
+        return (learned, *(a for a in IMAGE_ATTRIBUTES if a != learned))
+
+    def learn(self, host, page_selector=None, image_attribute=None):
+        with self._lock:
+            profile = self._profiles.setdefault(host, {})
+            changed = False
+            for key, value in (
+                ("page_selector", page_selector),
+                ("image_attribute", image_attribute),
+            ):
+                if value and profile.get(key) != value:
+                    profile[key] = value
+                    changed = True
+        if changed and self.path:
+            self.save()
+
+    def merge_file(self, path):
+        # Profiles from `path` win over what this machine learned
+        shared = self._read(path)
+        with self._lock:
+            for host, profile in shared.items():
+                if isinstance(profile, dict):
+                    self._profiles.setdefault(host, {}).update(profile)
+        if self.path:
+            self.save()
+
+    def save(self, path=None):
+        path = path or self.path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self._profiles, indent=2, sort_keys=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
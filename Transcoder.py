@@ -0,0 +1,138 @@
+import hashlib
+import os
+from PIL import Image
+from ArchiveBuilder import chapter_images
+
+# Canonical extension of every format a page can be stored in
+EXTENSIONS = {
+    "jpeg": ".jpg",
+    "png": ".png",
+    "gif": ".gif",
+    "webp": ".webp",
+    "avif": ".avif",
+}
+PAGE_EXTENSIONS = tuple(EXTENSIONS.values())
+TARGET_FORMATS = ("jpeg", "webp", "avif")
+PIL_FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "avif": "AVIF"}
+
+
+def sniff_format(head):
+    # Format from the leading bytes of a file, or None if it is not an image
+    # a page can be stored as. Hosts often serve PNG or WebP under .jpg URLs.
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis"):
+        return "avif"
+    return None
+
+
+def detect_format(path):
+    with open(path, "rb") as f:
+        return sniff_format(f.read(16))
+
+
+class TranscodedPage:
+    __slots__ = ("path", "new_path", "original_size", "size", "sha256", "action")
+
+    def __init__(self, path, new_path, original_size, size, sha256, action):
+        self.path = path
+        self.new_path = new_path
+        self.original_size = original_size
+        self.size = size
+        # Only set when the content changed
+        self.sha256 = sha256
+        # converted, renamed, unchanged, unknown or failed
+        self.action = action
+
+
+class Transcoder:
+    # Post-download stage for the pages of a chapter: gives each page the
+    # extension of its real format and optionally downscales pages wider
+    # than `max_width` and re-encodes them as `target_format`. Pages already
+    # in the target format are only re-encoded when they are resized, and a
+    # re-encode that comes out larger than the original is thrown away.
+    #
+    # Page files may be hardlinked from the page store, so they are never
+    # written to: the new page is written next to the old one and renamed
+    # over it. Runs inside the chapter packaging processes, so instances
+    # only hold picklable settings.
+    def __init__(self, max_width=None, target_format=None, quality=80):
+        if target_format is not None and target_format not in TARGET_FORMATS:
+            raise ValueError(f"Unknown target format: {target_format}")
+        self.max_width = max_width
+        self.target_format = target_format
+        self.quality = quality
+
+    def transcode_chapter(self, chapter_path):
+        pages = []
+        for name in chapter_images(chapter_path):
+            path = f"{chapter_path}/{name}"
+            try:
+                pages.append(self.transcode_page(path))
+            except OSError as e:
+                print(f"Could not transcode {name}: {e}")
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                pages.append(TranscodedPage(path, path, size, size, None, "failed"))
+        return pages
+
+    def transcode_page(self, path):
+        original_size = os.path.getsize(path)
+        fmt = detect_format(path)
+        if fmt is None:
+            return TranscodedPage(path, path, original_size, original_size, None, "unknown")
+        base = os.path.splitext(path)[0]
+        converted = None
+        with Image.open(path) as image:
+            resize = self.max_width is not None and image.width > self.max_width
+            target = self.target_format or fmt
+            if resize or target != fmt:
+                if target not in PIL_FORMATS:
+                    # Resized GIFs are kept lossless
+                    target = "png"
+                converted = self._encode(
+                    image, original_size, resize, target, f"{base}{EXTENSIONS[target]}"
+                )
+        if converted is not None:
+            new_path, size, sha256 = converted
+            if new_path != path:
+                os.remove(path)
+            return TranscodedPage(path, new_path, original_size, size, sha256, "converted")
+        new_path = f"{base}{EXTENSIONS[fmt]}"
+        if new_path == path:
+            return TranscodedPage(path, path, original_size, original_size, None, "unchanged")
+        # A rename leaves the file contents, and so any hardlink, alone
+        os.replace(path, new_path)
+        return TranscodedPage(path, new_path, original_size, original_size, None, "renamed")
+
+    def _encode(self, image, original_size, resize, target, new_path):
+        if resize:
+            height = max(round(image.height * self.max_width / image.width), 1)
+            image = image.resize((self.max_width, height), Image.LANCZOS)
+        if target == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        options = {"optimize": True} if target == "png" else {"quality": self.quality}
+        tmp_path = f"{new_path}.{os.getpid()}.tmp"
+        try:
+            image.save(tmp_path, PIL_FORMATS[target], **options)
+            size = os.path.getsize(tmp_path)
+            if not resize and size >= original_size:
+                os.remove(tmp_path)
+                return None
+            digest = hashlib.sha256()
+            with open(tmp_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            os.replace(tmp_path, new_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return new_path, size, digest.hexdigest()
@@ -1,73 +1,264 @@
+import hashlib
+import time
 import requests
 from time import sleep
-from random import randint, uniform
 import re
-from PIL import Image
 import os
-from PyPDF2 import PdfWriter as PdfWriter, PdfReader
+import ChapterParser
+from HttpSession import HttpSession
+from Metrics import Metrics
+from ArchiveBuilder import chapter_images, open_archive
+from PdfBuilder import StreamingPdfWriter
+from PdfPipeline import PdfMergePool
+from VolumeAssembler import VolumeAssembler
+from RateLimiter import RateLimiter
+
+
+class IncompleteDownload(requests.RequestException):
+    pass
 
 
 class Utils:
-    def __init__(self, logger):
+    def __init__(
+        self,
+        logger,
+        session=None,
+        rate_limiter=None,
+        http_cache=None,
+        metrics=None,
+        bandwidth=None,
+    ):
         self.logger = logger
+        self.session = session or HttpSession(logger)
+        self.rate_limiter = rate_limiter or RateLimiter(logger)
+        self.http_cache = http_cache
+        self.metrics = metrics or Metrics()
+        # Optional BandwidthLimiter shared with other downloads
+        self.bandwidth = bandwidth
 
     @staticmethod
     def parse_chapter_number(input_str):
-        pattern = re.compile(
-            r"(?:chapter|ch|issue|\/|\s|-|_)\s*(\d+(?:[\.-]\d+)?)", re.IGNORECASE
-        )
-        matches = pattern.findall(input_str)
-
-        # Filter only those numbers which have preceding markers like "chapter", "ch" or "issue"
-        filtered_matches = [
-            m
-            for m, full in [(m, f) for m in matches for f in input_str.split(m)]
-            if "chapter" in full.lower()
-            or "ch" in full.lower()
-            or "issue" in full.lower()
-        ]
-
-        if filtered_matches:
-            last_match = filtered_matches[-1]
-            return (
-                float(last_match.replace("-", "."))
-                if ("." in last_match or "-" in last_match)
-                else int(last_match)
-            )
-        elif matches:
-            # If no filtered match is found, revert to the last found match as a fallback.
-            last_match = matches[-1]
-            return (
-                float(last_match.replace("-", "."))
-                if ("." in last_match or "-" in last_match)
-                else int(last_match)
-            )
-        return None
+        return ChapterParser.parse_chapter_number(input_str)
 
-    def make_request(
-        self, url, return_bytes=False, max_retries=3, sleep_min=2, sleep_max=5
-    ):
+    def record_request(self, host, kind, started, status, size=0):
+        # One sample per HTTP attempt, including the failed ones
+        self.metrics.observe(
+            "manga_http_request_seconds", time.perf_counter() - started, host=host, kind=kind
+        )
+        self.metrics.inc("manga_http_requests_total", host=host, kind=kind, status=status)
+        if size:
+            self.metrics.inc("manga_http_bytes_total", size, host=host, kind=kind)
+
+    def record_retry(self, host, kind, retries, max_retries):
+        if retries < max_retries:
+            self.metrics.inc("manga_http_retries_total", host=host, kind=kind)
+        else:
+            self.metrics.inc("manga_http_failures_total", host=host, kind=kind)
+
+    def make_request(self, url, return_bytes=False, max_retries=3):
+        # Only HTML is cached; images are handled by download_file
+        cache = None if return_bytes else self.http_cache
+        host = RateLimiter.host_of(url)
+        kind = "bytes" if return_bytes else "html"
+        entry = cache.lookup(url) if cache else None
+        if entry and cache.is_fresh(entry):
+            body = cache.read(url)
+            if body is not None:
+                self.metrics.inc("manga_http_cache_hits_total", host=host, result="fresh")
+                return body
+            entry = None
         retries = 0
         while retries < max_retries:
+            self.rate_limiter.acquire(url)
+            started = time.perf_counter()
+            status = "error"
             try:
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36"
-                }
-                response = requests.get(url, timeout=10, headers=headers)
+                response = self.session.get(
+                    url,
+                    timeout=10,
+                    headers=cache.conditional_headers(entry) if entry else None,
+                )
+                status = response.status_code
+                if entry and response.status_code == 304:
+                    self.rate_limiter.record_success(url)
+                    self.record_request(host, kind, started, status)
+                    body = cache.read(url, revalidated=True)
+                    if body is not None:
+                        self.metrics.inc(
+                            "manga_http_cache_hits_total", host=host, result="revalidated"
+                        )
+                        return body
+                    # Cached body is gone, ask again without validators
+                    entry = None
+                    continue
                 response.raise_for_status()
-                # Random sleep between requests
-                sleep(uniform(sleep_min, sleep_max))
-                return response.content if return_bytes else response.text
+                self.rate_limiter.record_success(url)
+                self.record_request(host, kind, started, status, len(response.content))
+                if return_bytes:
+                    return response.content
+                if cache:
+                    cache.record_miss()
+                    self.metrics.inc("manga_http_cache_misses_total", host=host)
+                    cache.store(url, response.text, response.headers)
+                return response.text
             except requests.RequestException as e:
                 retries += 1
+                self.record_request(host, kind, started, status)
+                self.record_retry(host, kind, retries, max_retries)
+                failed = getattr(e, "response", None)
+                delay = self.rate_limiter.record_failure(
+                    url,
+                    retries,
+                    status=failed.status_code if failed is not None else None,
+                    retry_after=(
+                        failed.headers.get("Retry-After") if failed is not None else None
+                    ),
+                )
                 self.logger.error(
                     "HTTP request failed: %s. Retrying %s/%s", e, retries, max_retries
                 )
-                sleep(randint(5, 10))  # Sleep for a bit before retrying
+                if retries < max_retries:
+                    sleep(delay)
 
         self.logger.error("Failed to retrieve data after %s attempts.", max_retries)
         return None
 
+    def probe_size(self, url, max_retries=2):
+        # Size of `url` from a HEAD request, or None if the server does not
+        # say. Hosts that refuse HEAD get a one byte range GET instead.
+        host = RateLimiter.host_of(url)
+        retries = 0
+        while retries < max_retries:
+            self.rate_limiter.acquire(url)
+            started = time.perf_counter()
+            status = "error"
+            try:
+                response = self.session.head(url, timeout=10, allow_redirects=True)
+                if response.status_code in (403, 405, 501):
+                    response = self.session.get(
+                        url, timeout=10, headers={"Range": "bytes=0-0"}, stream=True
+                    )
+                    response.close()
+                status = response.status_code
+                response.raise_for_status()
+                self.rate_limiter.record_success(url)
+                self.record_request(host, "head", started, status)
+                return self.expected_length(status, response.headers, 0)
+            except requests.RequestException as e:
+                retries += 1
+                self.record_request(host, "head", started, status)
+                self.record_retry(host, "head", retries, max_retries)
+                failed = getattr(e, "response", None)
+                delay = self.rate_limiter.record_failure(
+                    url,
+                    retries,
+                    status=failed.status_code if failed is not None else None,
+                    retry_after=(
+                        failed.headers.get("Retry-After") if failed is not None else None
+                    ),
+                )
+                if retries < max_retries:
+                    sleep(delay)
+        return None
+
+    @staticmethod
+    def hash_file(path, chunk_size=1024 * 1024):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def expected_length(status, headers, offset):
+        # Full size of the resource once this response has been appended to
+        # the first `offset` bytes, or None when the server does not say.
+        if headers.get("Content-Encoding", "identity") != "identity":
+            return None
+        if status == 206:
+            content_range = headers.get("Content-Range", "")
+            total = content_range.rpartition("/")[2]
+            if total.isdigit():
+                return int(total)
+        length = headers.get("Content-Length")
+        if length is None or not length.isdigit():
+            return None
+        return offset + int(length) if status == 206 else int(length)
+
+    @staticmethod
+    def finish_download(part_path, path, expected):
+        size = os.path.getsize(part_path)
+        if expected is not None and size != expected:
+            if size > expected:
+                os.remove(part_path)
+            raise IncompleteDownload(
+                f"Got {size} of {expected} bytes for {os.path.basename(path)}"
+            )
+        os.replace(part_path, path)
+        return size
+
+    def download_file(self, url, path, chunk_size=64 * 1024, max_retries=3):
+        # Streams into `<path>.part` and renames it into place once complete,
+        # so `path` only ever exists as a whole file. A leftover .part from an
+        # interrupted run is resumed with a Range request.
+        part_path = f"{path}.part"
+        host = RateLimiter.host_of(url)
+        retries = 0
+        while retries < max_retries:
+            self.rate_limiter.acquire(url)
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+            started = time.perf_counter()
+            status = "error"
+            received = 0
+            try:
+                with self.session.get(
+                    url, timeout=10, stream=True, headers=headers
+                ) as response:
+                    status = response.status_code
+                    if response.status_code == 416 and offset:
+                        # The partial file no longer matches the remote one
+                        os.remove(part_path)
+                        raise IncompleteDownload(f"Stale partial download for {url}")
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        offset = 0
+                    expected = self.expected_length(
+                        response.status_code, response.headers, offset
+                    )
+                    with open(part_path, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(chunk_size):
+                            if chunk:
+                                f.write(chunk)
+                                received += len(chunk)
+                                if self.bandwidth is not None:
+                                    self.bandwidth.consume(len(chunk))
+                size = self.finish_download(part_path, path, expected)
+                self.rate_limiter.record_success(url)
+                self.record_request(host, "image", started, status, received)
+                return size
+            except requests.RequestException as e:
+                retries += 1
+                self.record_request(host, "image", started, status, received)
+                self.record_retry(host, "image", retries, max_retries)
+                failed = getattr(e, "response", None)
+                delay = self.rate_limiter.record_failure(
+                    url,
+                    retries,
+                    status=failed.status_code if failed is not None else None,
+                    retry_after=(
+                        failed.headers.get("Retry-After") if failed is not None else None
+                    ),
+                )
+                self.logger.error(
+                    "Download failed: %s. Retrying %s/%s", e, retries, max_retries
+                )
+                if retries < max_retries:
+                    sleep(delay)
+
+        self.logger.error("Failed to download %s after %s attempts.", url, max_retries)
+        return None
+
     @staticmethod
     def merge_images_to_pdf(chapter_path, pdf_name="merged"):
         if not os.path.exists(chapter_path):
@@ -76,38 +267,63 @@ class Utils:
             print(f"{pdf_name}.pdf already exists")
             return None
 
-        image_files = [
-            f for f in os.listdir(chapter_path) if f.endswith((".jpg", ".jpeg", ".png"))
-        ]
-        image_files.sort()
+        image_files = chapter_images(chapter_path)
         if not image_files:
             print("No image files to merge.")
             return
 
-        image_list = []
-        for image_file in image_files:
-            try:
-                image = Image.open(os.path.join(chapter_path, image_file))
-                image = image.convert("RGB")
-                image_list.append(image)
-            except OSError as e:
-                print(f"Skipping {image_file}: {e}")
-
-        if not image_list:
-            print("No valid image files to merge.")
-            return
-
         pdf_path = os.path.join(chapter_path, f"{pdf_name}.pdf")
-        image_list[0].save(pdf_path, save_all=True, append_images=image_list[1:])
+        with StreamingPdfWriter(pdf_path) as writer:
+            for image_file in image_files:
+                try:
+                    writer.add_image(os.path.join(chapter_path, image_file))
+                except OSError as e:
+                    print(f"Skipping {image_file}: {e}")
 
+            if writer.page_count == 0:
+                print("No valid image files to merge.")
+                return
 
-def merge_images_to_pdf(path, utils_instance):
-    for _, dirnames, _ in os.walk(path):
-        for dirname in dirnames:
-            utils_instance.merge_images_to_pdf(
-                os.path.join(path, dirname),
-                dirname,
-            )
+    @staticmethod
+    def package_chapter(chapter_path, name, formats=("pdf",), transcoder=None):
+        # merge_images_to_pdf for any mix of pdf, cbz and epub. Archives copy
+        # the page files in as they are. With a Transcoder the pages are
+        # transcoded first, and what it did to each page is returned.
+        pages = transcoder.transcode_chapter(chapter_path) if transcoder is not None else []
+        for fmt in formats:
+            if fmt == "pdf":
+                Utils.merge_images_to_pdf(chapter_path, name)
+                continue
+            archive_path = os.path.join(chapter_path, f"{name}.{fmt}")
+            if os.path.exists(archive_path):
+                print(f"{name}.{fmt} already exists")
+                continue
+            image_files = chapter_images(chapter_path)
+            if not image_files:
+                print("No image files to package.")
+                continue
+            with open_archive(archive_path, fmt, name) as writer:
+                for image_file in image_files:
+                    try:
+                        writer.add_image(os.path.join(chapter_path, image_file))
+                    except OSError as e:
+                        print(f"Skipping {image_file}: {e}")
+        return pages
+
+
+def merge_images_to_pdf(path, utils_instance, max_workers=None):
+    merge_pool = PdfMergePool(
+        utils_instance.logger,
+        utils_instance.merge_images_to_pdf,
+        max_workers,
+        utils_instance.metrics,
+    )
+    try:
+        for dirname in sorted(next(os.walk(path))[1], key=natural_sort_key):
+            merge_pool.submit(os.path.join(path, dirname), dirname)
+        return merge_pool.wait()
+    finally:
+        merge_pool.shutdown()
 
 
 def natural_sort_key(s):
@@ -123,89 +339,42 @@ def merge_chapters_into_volumes(
     output_path,
     utils_instance,
     chapters_per_volume=12,
-    start_volume_number=1
+    start_volume_number=1,
+    max_workers=None,
 ):
-    pdf_writer = PdfWriter()
-
-    volume_number = start_volume_number
-    chapter_count = 0
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-
-    # Sort directories first
-    dirnames = next(os.walk(main_directory_path))[1]
-    sorted_dirnames = sorted(
-        dirnames,
-        key=lambda x: utils_instance.parse_chapter_number(x)
-        if x.startswith("chapter_")
-        else float("inf"),  # Any non-matching directory names go to the end
-    )
-    total_chapter_count = sum(
-        len([f for f in files if f.endswith(".pdf") and f.startswith("chapter")])
-        for _, _, files in os.walk(main_directory_path)
+    assembler = VolumeAssembler(utils_instance.logger, max_workers, utils_instance.metrics)
+    return assembler.assemble(
+        main_directory_path,
+        covers_path,
+        output_path,
+        utils_instance.parse_chapter_number,
+        chapters_per_volume,
+        start_volume_number,
     )
 
-    for dirname in sorted_dirnames:
-        dirpath = os.path.join(main_directory_path, dirname)
-        for _, _, filenames in os.walk(dirpath):
-            for filename in sorted(
-                [f for f in filenames if f.endswith(".pdf") and f.startswith("chapter")]
-            ):
-                chapter_count += 1
-                print(
-                    f"Processing {filename}, Chapter Count: {chapter_count}, Volume: {volume_number}, chapter_count % chapters_per_volume = {chapter_count % chapters_per_volume}"
-                )
-
-                # Your existing code to process each PDF
-                pdf_reader = PdfReader(open(os.path.join(dirpath, filename), "rb"))
-
-                # Add each page to the writer object
-                for page in pdf_reader.pages:
-                    pdf_writer.add_page(page)
-
-                # If the required chapters per volume are reached, add a cover and save the PDF
-                is_last_chapter = chapter_count == total_chapter_count
-                should_create_pdf = (
-                    chapter_count % chapters_per_volume == 0
-                ) or is_last_chapter
 
-                if should_create_pdf:
-                    cover_image_path = os.path.join(covers_path, f"{volume_number}.jpg")
-                    if not os.path.exists(cover_image_path):
-                        cover_image_path = os.path.join(covers_path, "placeholder.jpg")
-
-                    if os.path.exists(cover_image_path):
-                        cover_image = Image.open(cover_image_path).convert("RGB")
-                        cover_image.save("cover.pdf")
-                        cover_pdf = PdfReader(open("cover.pdf", "rb"))
-
-                        # Create a new PdfWriter object for rearranging pages
-                        new_pdf_writer = PdfWriter()
-
-                        # Add cover
-                        new_pdf_writer.add_page(cover_pdf.pages[0])
-
-                        # Add other pages
-                        for page in pdf_writer.pages:
-                            new_pdf_writer.add_page(page)
-
-                        # Save the complete PDF (cover + chapters)
-
-                        volume_pdf_path = os.path.join(
-                            output_path, f"volume_{volume_number}.pdf"
-                        )
-                        with open(volume_pdf_path, "wb") as f_out:
-                            new_pdf_writer.write(f_out)
-
-                        # Increment the volume number
-                        volume_number += 1
-
-                        # Clean up and prepare for the next volume
-                        pdf_writer = PdfWriter()
-                    else:
-                        print(
-                            f"Cover image for volume {volume_number} not found. Skipping this volume."
-                        )
+def package_chapters_into_volumes(
+    main_directory_path,
+    covers_path,
+    output_path,
+    utils_instance,
+    fmt="cbz",
+    chapters_per_volume=12,
+    start_volume_number=1,
+    max_workers=None,
+):
+    # merge_chapters_into_volumes for CBZ or EPUB, straight from the chapter
+    # images rather than from chapter PDFs
+    assembler = VolumeAssembler(utils_instance.logger, max_workers, utils_instance.metrics)
+    return assembler.assemble_archives(
+        main_directory_path,
+        covers_path,
+        output_path,
+        utils_instance.parse_chapter_number,
+        fmt,
+        chapters_per_volume,
+        start_volume_number,
+    )
 
 
 if __name__ == "__main__":
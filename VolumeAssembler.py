@@ -0,0 +1,231 @@
+import io
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from PIL import Image
+from PyPDF2 import PdfReader, PdfWriter
+from ArchiveBuilder import build_volume_archive, chapter_images
+
+
+def render_cover(cover_image_path):
+    # Renders the cover to a one-page PDF in memory instead of a cover.pdf in
+    # the working directory, so several series can be assembled at once.
+    buffer = io.BytesIO()
+    with Image.open(cover_image_path) as cover_image:
+        cover_image.convert("RGB").save(buffer, format="PDF")
+    buffer.seek(0)
+    return PdfReader(buffer)
+
+
+def build_volume(volume_pdf_path, cover_image_path, chapter_pdf_paths):
+    started = time.perf_counter()
+    pdf_writer = PdfWriter()
+    pdf_writer.add_page(render_cover(cover_image_path).pages[0])
+    with ExitStack() as stack:
+        for chapter_pdf_path in chapter_pdf_paths:
+            pdf_reader = PdfReader(stack.enter_context(open(chapter_pdf_path, "rb")))
+            for page in pdf_reader.pages:
+                pdf_writer.add_page(page)
+
+        tmp_path = f"{volume_pdf_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f_out:
+            pdf_writer.write(f_out)
+    os.replace(tmp_path, volume_pdf_path)
+    return len(pdf_writer.pages), time.perf_counter() - started
+
+
+class VolumeAssembler:
+    def __init__(self, logger=None, max_workers=None, metrics=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.metrics = metrics
+
+    @staticmethod
+    def find_chapter_pdfs(main_directory_path, sort_key):
+        # Single walk of the series directory: chapter PDFs grouped by their
+        # top-level chapter directory, in reading order.
+        chapter_pdfs = {}
+        for dirpath, _, filenames in os.walk(main_directory_path):
+            relative = os.path.relpath(dirpath, main_directory_path)
+            if relative == os.curdir:
+                continue
+            top_level = relative.split(os.sep)[0]
+            pdfs = sorted(
+                f for f in filenames if f.endswith(".pdf") and f.startswith("chapter")
+            )
+            chapter_pdfs.setdefault(top_level, []).extend(
+                os.path.join(dirpath, f) for f in pdfs
+            )
+
+        sorted_dirnames = sorted(
+            chapter_pdfs,
+            key=lambda x: sort_key(x)
+            if x.startswith("chapter_")
+            else float("inf"),  # Any non-matching directory names go to the end
+        )
+        return [path for dirname in sorted_dirnames for path in chapter_pdfs[dirname]]
+
+    @staticmethod
+    def find_chapter_directories(main_directory_path, sort_key):
+        # Chapter directories holding images, in reading order
+        dirnames = [
+            dirname
+            for dirname in next(os.walk(main_directory_path))[1]
+            if dirname.startswith("chapter_")
+            and chapter_images(os.path.join(main_directory_path, dirname))
+        ]
+        dirnames.sort(key=sort_key)
+        return [os.path.join(main_directory_path, dirname) for dirname in dirnames]
+
+    def plan(
+        self,
+        chapter_pdf_paths,
+        covers_path,
+        output_path,
+        chapters_per_volume=12,
+        start_volume_number=1,
+        extension="pdf",
+    ):
+        volumes = []
+        volume_number = start_volume_number
+        pending = []
+        for chapter_count, chapter_pdf_path in enumerate(chapter_pdf_paths, start=1):
+            pending.append(chapter_pdf_path)
+            is_last_chapter = chapter_count == len(chapter_pdf_paths)
+            if chapter_count % chapters_per_volume != 0 and not is_last_chapter:
+                continue
+
+            cover_image_path = os.path.join(covers_path, f"{volume_number}.jpg")
+            if not os.path.exists(cover_image_path):
+                cover_image_path = os.path.join(covers_path, "placeholder.jpg")
+            if not os.path.exists(cover_image_path):
+                # Same as before: the chapters roll over into the next volume
+                self.logger.warning(
+                    "Cover image for volume %s not found. Skipping this volume.",
+                    volume_number,
+                )
+                continue
+
+            volume_pdf_path = os.path.join(output_path, f"volume_{volume_number}.{extension}")
+            volumes.append((volume_pdf_path, cover_image_path, pending))
+            volume_number += 1
+            pending = []
+        return volumes
+
+    def assemble(
+        self,
+        main_directory_path,
+        covers_path,
+        output_path,
+        sort_key,
+        chapters_per_volume=12,
+        start_volume_number=1,
+    ):
+        if not os.path.exists(output_path):
+            os.makedirs(output_path, exist_ok=True)
+        chapter_pdf_paths = self.find_chapter_pdfs(main_directory_path, sort_key)
+        volumes = self.plan(
+            chapter_pdf_paths,
+            covers_path,
+            output_path,
+            chapters_per_volume,
+            start_volume_number,
+        )
+        self.logger.info(
+            "Assembling %s chapters into %s volumes", len(chapter_pdf_paths), len(volumes)
+        )
+
+        built = []
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                (volume[0], executor.submit(build_volume, *volume)) for volume in volumes
+            ]
+            for volume_pdf_path, future in futures:
+                try:
+                    page_count, seconds = future.result()
+                    self.logger.info(
+                        "Built %s (%s pages) in %.2fs", volume_pdf_path, page_count, seconds
+                    )
+                    built.append(volume_pdf_path)
+                    if self.metrics is not None:
+                        self.metrics.observe("manga_stage_seconds", seconds, stage="volume")
+                        self.metrics.inc("manga_volume_pages_total", page_count)
+                except Exception as e:
+                    if self.metrics is not None:
+                        self.metrics.inc("manga_stage_failures_total", stage="volume")
+                    self.logger.error(
+                        "Error building %s: %s\n%s",
+                        volume_pdf_path,
+                        e,
+                        traceback.format_exc(),
+                    )
+        return built
+
+    def assemble_archives(
+        self,
+        main_directory_path,
+        covers_path,
+        output_path,
+        sort_key,
+        fmt="cbz",
+        chapters_per_volume=12,
+        start_volume_number=1,
+    ):
+        # Same volume plan as assemble(), packaged from the chapter images.
+        # Copying files is I/O bound, so threads are enough here.
+        if not os.path.exists(output_path):
+            os.makedirs(output_path, exist_ok=True)
+        chapter_paths = self.find_chapter_directories(main_directory_path, sort_key)
+        volumes = self.plan(
+            chapter_paths,
+            covers_path,
+            output_path,
+            chapters_per_volume,
+            start_volume_number,
+            fmt,
+        )
+        self.logger.info(
+            "Packaging %s chapters into %s %s volumes", len(chapter_paths), len(volumes), fmt
+        )
+
+        built = []
+        title = os.path.basename(os.path.normpath(main_directory_path))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                (
+                    volume_path,
+                    executor.submit(
+                        build_volume_archive,
+                        volume_path,
+                        cover_image_path,
+                        chapters,
+                        fmt,
+                        f"{title} {os.path.splitext(os.path.basename(volume_path))[0]}",
+                        self.logger,
+                    ),
+                )
+                for volume_path, cover_image_path, chapters in volumes
+            ]
+            for volume_path, future in futures:
+                try:
+                    page_count, seconds = future.result()
+                    self.logger.info(
+                        "Built %s (%s pages) in %.2fs", volume_path, page_count, seconds
+                    )
+                    built.append(volume_path)
+                    if self.metrics is not None:
+                        self.metrics.observe("manga_stage_seconds", seconds, stage="volume")
+                        self.metrics.inc("manga_volume_pages_total", page_count)
+                except Exception as e:
+                    if self.metrics is not None:
+                        self.metrics.inc("manga_stage_failures_total", stage="volume")
+                    self.logger.error(
+                        "Error building %s: %s\n%s",
+                        volume_path,
+                        e,
+                        traceback.format_exc(),
+                    )
+        return built
@@ -0,0 +1,92 @@
+import timeit
+import ChapterParser
+from ChapterParser import ChapterIndex
+from test import parse_chapter_number, test_cases
+
+CHAPTER_COUNT = 1000
+
+
+def legacy_find(links, chapter):
+    for i, (href, text) in enumerate(links):
+        chapter_number = parse_chapter_number(href) or parse_chapter_number(text)
+        if str(chapter_number) == chapter:
+            return i
+    return None
+
+
+def report(name, seconds, runs):
+    print(f"{name:<40} {seconds / runs * 1e6:>10.2f} us/run")
+
+
+def main():
+    uncached = ChapterParser.parse_chapter_number.__wrapped__
+    # The fast parser has to agree with the original one, including on the
+    # cases where both still differ from expected_outputs
+    for test_case in test_cases:
+        assert ChapterParser.parse_chapter_number(test_case) == parse_chapter_number(
+            test_case
+        ), test_case
+
+    runs = 2000
+    report(
+        "test.py cases, legacy parser",
+        timeit.timeit(lambda: [parse_chapter_number(c) for c in test_cases], number=runs),
+        runs,
+    )
+    report(
+        "test.py cases, compiled parser",
+        timeit.timeit(lambda: [uncached(c) for c in test_cases], number=runs),
+        runs,
+    )
+    report(
+        "test.py cases, memoized parser",
+        timeit.timeit(
+            lambda: [ChapterParser.parse_chapter_number(c) for c in test_cases],
+            number=runs,
+        ),
+        runs,
+    )
+
+    # A long series with decimal chapters, shaped like the test.py URLs
+    links = []
+    for n in range(1, CHAPTER_COUNT + 1):
+        links.append(
+            (
+                f"https://w2.tonikakukawaii.com/manga/tonikaku-cawaii-chapter-{n}/",
+                f"chapter {n}",
+            )
+        )
+        if n % 10 == 0:
+            links.append(
+                (
+                    f"https://w2.tonikakukawaii.com/manga/tonikaku-cawaii-chapter-{n}-5/",
+                    f"chapter {n}.5",
+                )
+            )
+    start_ch, end_ch = "900.5", str(CHAPTER_COUNT)
+
+    runs = 5
+    report(
+        f"range lookup over {len(links)} links, legacy",
+        timeit.timeit(
+            lambda: (legacy_find(links, start_ch), legacy_find(links, end_ch)),
+            number=runs,
+        ),
+        runs,
+    )
+
+    def indexed():
+        ChapterParser.parse_chapter_number.cache_clear()
+        index = ChapterIndex(links)
+        return index.find(start_ch), index.find(end_ch)
+
+    assert indexed() == (legacy_find(links, start_ch), legacy_find(links, end_ch))
+    report(
+        f"range lookup over {len(links)} links, index",
+        timeit.timeit(indexed, number=runs),
+        runs,
+    )
+
+
+if __name__ == "__main__":
+    main()
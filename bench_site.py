@@ -0,0 +1,227 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+from PIL import Image
+from AsyncMangaScraper import AsyncMangaScraper
+from ChapterListing import Pagination
+from MangaScraper import MangaScraper
+from Metrics import Metrics
+from MockMangaSite import MockMangaSite
+from RateLimiter import RateLimiter
+from Utils import (
+    Utils,
+    merge_chapters_into_volumes,
+    merge_images_to_pdf,
+    package_chapters_into_volumes,
+)
+
+MANGA_TITLE = "Benchmark Manga"
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux; children covers the process pools
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own, children
+
+
+def directory_stats(path, extensions):
+    count = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.endswith(extensions):
+                count += 1
+                size += os.path.getsize(os.path.join(dirpath, filename))
+    return count, size
+
+
+def run(args):
+    logger = logging.getLogger("bench")
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    rate_limiter = RateLimiter(logger, rate=args.rate, burst=args.rate, max_rate=args.rate * 4)
+    metrics = Metrics(json_path=args.metrics, profile_dir=args.profile_dir)
+    ready_times = []
+
+    def progress(event):
+        if event["event"] == "chapter_ready":
+            ready_times.append(time.perf_counter())
+
+    if args.engine == "async":
+        scraper = AsyncMangaScraper(
+            logger,
+            max_per_host=args.workers,
+            rate_limiter=rate_limiter,
+            metrics=metrics,
+            progress=progress,
+        )
+    else:
+        scraper = MangaScraper(
+            logger,
+            max_workers=args.workers,
+            max_per_host=args.workers,
+            rate_limiter=rate_limiter,
+            pdf_workers=args.pdf_workers,
+            metrics=metrics,
+            progress=progress,
+            lookahead=args.lookahead,
+        )
+
+    site = MockMangaSite(
+        chapters=args.chapters,
+        pages_per_chapter=args.pages,
+        image_size=args.image_kb * 1024,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        bandwidth=args.bandwidth_kb * 1024 if args.bandwidth_kb else None,
+        chapters_per_listing=args.chapters_per_listing,
+    )
+    pagination = Pagination(next_selector="a.next") if args.chapters_per_listing else None
+    stages = {}
+    with site:
+        started = time.perf_counter()
+        scraper.start_scraping(
+            None,
+            None,
+            MANGA_TITLE,
+            site.series_url,
+            "img.page",
+            "a.chapter-link",
+            [],
+            False,
+            pagination=pagination,
+        )
+        stages["download"] = time.perf_counter() - started
+        first_ready = min(ready_times) - started if ready_times else None
+
+    series_path = os.path.join("manga_downloads", MANGA_TITLE)
+    pages, page_bytes = directory_stats(series_path, (".jpg",))
+
+    utils = Utils(logger, metrics=metrics)
+    started = time.perf_counter()
+    if args.format == "pdf":
+        merge_images_to_pdf(series_path, utils, args.pdf_workers)
+    else:
+        for dirname in next(os.walk(series_path))[1]:
+            utils.package_chapter(os.path.join(series_path, dirname), dirname, (args.format,))
+    stages[args.format] = time.perf_counter() - started
+
+    covers_path = os.path.join(series_path, "covers")
+    os.makedirs(covers_path, exist_ok=True)
+    Image.new("RGB", (800, 1200), "white").save(os.path.join(covers_path, "placeholder.jpg"))
+    started = time.perf_counter()
+    volumes_path = os.path.join("manga_downloads", f"{MANGA_TITLE} volumes")
+    if args.format == "pdf":
+        merge_chapters_into_volumes(
+            series_path,
+            covers_path,
+            volumes_path,
+            utils,
+            chapters_per_volume=args.chapters_per_volume,
+            max_workers=args.pdf_workers,
+        )
+    else:
+        package_chapters_into_volumes(
+            series_path,
+            covers_path,
+            volumes_path,
+            utils,
+            args.format,
+            chapters_per_volume=args.chapters_per_volume,
+            max_workers=args.pdf_workers,
+        )
+    stages["volumes"] = time.perf_counter() - started
+    metrics.flush()
+
+    own_rss, children_rss = peak_rss_kb()
+    return {
+        "engine": args.engine,
+        "chapters": args.chapters,
+        "pages": pages,
+        "expected_pages": args.chapters * args.pages,
+        "bytes": page_bytes,
+        "requests": site.requests,
+        "injected_errors": site.errors,
+        "stage_seconds": stages,
+        "first_chapter_ready_seconds": first_ready,
+        "pages_per_second": pages / stages["download"] if stages["download"] else 0,
+        "bytes_per_second": page_bytes / stages["download"] if stages["download"] else 0,
+        "peak_rss_kb": own_rss,
+        "peak_children_rss_kb": children_rss,
+    }
+
+
+def print_report(result):
+    print(f"engine            {result['engine']}")
+    print(f"pages             {result['pages']} / {result['expected_pages']}")
+    print(f"requests          {result['requests']} ({result['injected_errors']} injected errors)")
+    for stage, seconds in result["stage_seconds"].items():
+        print(f"{stage + ' time':<18}{seconds:.2f}s")
+    if result["first_chapter_ready_seconds"] is not None:
+        print(f"first ready       {result['first_chapter_ready_seconds']:.2f}s")
+    print(f"pages/s           {result['pages_per_second']:.1f}")
+    print(f"MB/s              {result['bytes_per_second'] / 1024 / 1024:.2f}")
+    print(f"peak RSS          {result['peak_rss_kb'] / 1024:.1f} MB")
+    print(f"peak child RSS    {result['peak_children_rss_kb'] / 1024:.1f} MB")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="End-to-end throughput benchmark against a local stand-in manga site"
+    )
+    parser.add_argument("--engine", choices=("sync", "async"), default="sync")
+    parser.add_argument("--chapters", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=20, help="pages per chapter")
+    parser.add_argument(
+        "--chapters-per-listing", type=int, default=None, help="paginate the chapter list"
+    )
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 429/503s")
+    parser.add_argument("--bandwidth-kb", type=int, default=0, help="KB/s per response")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--lookahead", type=int, default=2, help="chapters discovered ahead")
+    parser.add_argument("--pdf-workers", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=200.0, help="requests/s per host")
+    parser.add_argument("--format", choices=("pdf", "cbz", "epub"), default="pdf")
+    parser.add_argument("--chapters-per-volume", type=int, default=12)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    parser.add_argument("--metrics", help="write the pipeline metrics as JSON to this file")
+    parser.add_argument("--profile-dir", help="write cProfile stats for the hot sections here")
+    parser.add_argument("--keep", action="store_true", help="keep the download directory")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format="[%(asctime)s] %(message)s")
+    output = os.path.abspath(args.output) if args.output else None
+    for option in ("metrics", "profile_dir"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+    cwd = os.getcwd()
+    # The scrapers write to ./manga_downloads, so run inside a scratch directory
+    workdir = tempfile.mkdtemp(prefix="manga-bench-")
+    os.chdir(workdir)
+    try:
+        result = run(args)
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_report(result)
+    if args.keep:
+        print(f"downloads kept in {workdir}")
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,27 +2,143 @@ import tkinter as tk
 from tkinter import ttk, scrolledtext
 import logging
 import ast
+import queue
 import threading
+from ChapterListing import Pagination
 from MangaScraper import MangaScraper
 
 
 class TextHandler(logging.Handler):
-    def __init__(self, text, root):
+    # Only queues the formatted record; LogPump writes it out on the Tk thread
+    def __init__(self, lines):
         super().__init__()
-        self.text = text
-        self.root = root
+        self.lines = lines
 
     def emit(self, record):
-        msg = self.format(record)
-        self.root.after(0, self.append_text, msg)
-
-    def append_text(self, msg):
+        try:
+            self.lines.put(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class LogPump:
+    # Drains queued log lines and progress events on a timer, so a burst of
+    # records costs one widget update per tick instead of one Tk callback
+    # each. The widget keeps at most `max_lines` lines.
+    def __init__(
+        self,
+        root,
+        text,
+        progress_view=None,
+        max_lines=5000,
+        interval_ms=100,
+        max_batch=1000,
+    ):
+        self.root = root
+        self.text = text
+        self.progress_view = progress_view
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+        self.lines = queue.SimpleQueue()
+        self.events = queue.SimpleQueue()
+
+    def post_progress(self, event):
+        # Called from the scraping threads
+        self.events.put(event)
+
+    def start(self):
+        self.root.after(self.interval_ms, self.pump)
+
+    def drain(self, source):
+        items = []
+        while len(items) < self.max_batch:
+            try:
+                items.append(source.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def pump(self):
+        try:
+            lines = self.drain(self.lines)
+            if lines:
+                self.append_lines(lines)
+            events = self.drain(self.events)
+            if events and self.progress_view is not None:
+                self.progress_view.update_from(events)
+        finally:
+            self.root.after(self.interval_ms, self.pump)
+
+    def append_lines(self, lines):
         self.text.configure(state="normal")
-        self.text.insert(tk.END, msg + "\n")
+        self.text.insert(tk.END, "\n".join(lines[-self.max_lines:]) + "\n")
+        # Lines, not records: tracebacks span several
+        line_count = int(self.text.index("end-1c").split(".")[0]) - 1
+        if line_count > self.max_lines:
+            self.text.delete("1.0", f"{line_count - self.max_lines + 1}.0")
         self.text.configure(state="disabled")
         self.text.yview(tk.END)
 
 
+class ProgressView:
+    # Follows the scraper's progress events rather than its log text
+    def __init__(self, parent):
+        self.frame = ttk.Frame(parent)
+        self.label = ttk.Label(self.frame, text="Idle")
+        self.label.pack(fill=tk.X)
+        self.bar = ttk.Progressbar(self.frame, mode="determinate")
+        self.bar.pack(fill=tk.X)
+        self.reset()
+
+    def reset(self, title=""):
+        self.title = title
+        self.chapter = None
+        self.chapters_total = 0
+        self.chapters_done = 0
+        self.chapters_ready = 0
+        self.pages_total = 0
+        self.pages_done = 0
+        self.pages_failed = 0
+        self.finished = False
+
+    def update_from(self, events):
+        for event in events:
+            self.apply(event)
+        self.render()
+
+    def apply(self, event):
+        kind = event["event"]
+        if kind == "series":
+            self.reset(event["title"])
+            self.chapters_total = event["chapters"]
+        elif kind == "chapter":
+            self.chapter = event["chapter"]
+            self.pages_total += event["pages"]
+        elif kind == "page":
+            self.pages_done += 1
+            if not event["ok"]:
+                self.pages_failed += 1
+        elif kind == "chapter_done":
+            self.chapters_done += 1
+        elif kind == "chapter_ready":
+            self.chapters_ready += 1
+        elif kind == "done":
+            self.finished = True
+
+    def render(self):
+        status = "Done" if self.finished else f"Chapter {self.chapter}"
+        text = (
+            f"{self.title} - {status}: {self.chapters_done}/{self.chapters_total} chapters, "
+            f"{self.pages_done}/{self.pages_total} pages, {self.chapters_ready} ready to read"
+        )
+        if self.pages_failed:
+            text += f", {self.pages_failed} failed"
+        self.label["text"] = text
+        self.bar["maximum"] = max(self.pages_total, 1)
+        self.bar["value"] = self.pages_done
+
+
 class MangaScraperApp:
     def __init__(self):
         self.root = tk.Tk()
@@ -41,10 +157,16 @@ class MangaScraperApp:
                 "text": 'Alternative Chapter Page Selector ["selector1", "selector2", ...]:',
                 "widget_class": ttk.Entry,
             },
+            {"text": "Next Listing Page Selector:", "widget_class": ttk.Entry},
+            {"text": "Listing Page URL (with {page}):", "widget_class": ttk.Entry},
             {
                 "text": "Merge images into PDF for each chapter",
                 "widget_class": ttk.Checkbutton,
             },
+            {
+                "text": "Only download chapters added since the last run",
+                "widget_class": ttk.Checkbutton,
+            },
             {
                 "text": "Start Scraping",
                 "widget_class": ttk.Button,
@@ -67,23 +189,29 @@ class MangaScraperApp:
         self.root.grid_rowconfigure(len(self.ui_elements) + 1, weight=1)
         self.root.grid_columnconfigure(0, weight=1)
 
-        self.root.grid_rowconfigure(9, weight=1)
+        progress_view = ProgressView(self.root)
+        progress_view.frame.grid(row=len(self.ui_elements), columnspan=2, sticky="ew")
+
+        log_row = len(self.ui_elements) + 1
+        self.root.grid_rowconfigure(log_row, weight=1)
         self.root.grid_columnconfigure(0, weight=1)
 
         log_frame = tk.Frame(self.root)
-        log_frame.grid(row=9, columnspan=2, sticky="nsew")
+        log_frame.grid(row=log_row, columnspan=2, sticky="nsew")
         log_frame.grid_rowconfigure(0, weight=1)
         log_frame.grid_columnconfigure(0, weight=1)
 
         text = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD)
         text.pack(fill=tk.BOTH, expand=True)
 
-        handler = TextHandler(text, self.root)
+        log_pump = LogPump(self.root, text, progress_view)
+        handler = TextHandler(log_pump.lines)
         handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
         logger = logging.getLogger()
         logger.addHandler(handler)
         logger.setLevel(logging.INFO)
-        self.manga_scraper = MangaScraper(logger)
+        log_pump.start()
+        self.manga_scraper = MangaScraper(logger, progress=log_pump.post_progress)
 
     def create_ui_element(self, root, row, config):
         vertical_padding = 5
@@ -148,6 +276,10 @@ class MangaScraperApp:
         merge_images_into_pdf = (
             self.entries["Merge images into PDF for each chapter"]["var"].get() or False
         )
+        sync = (
+            self.entries["Only download chapters added since the last run"]["var"].get()
+            or False
+        )
 
         raw_alternative_selector = self.get_entry_value(
             'Alternative Chapter Page Selector ["selector1", "selector2", ...]:'
@@ -156,6 +288,12 @@ class MangaScraperApp:
             raw_alternative_selector
         )
 
+        next_page_selector = self.get_entry_value("Next Listing Page Selector:") or None
+        listing_url_pattern = self.get_entry_value("Listing Page URL (with {page}):") or None
+        pagination = None
+        if next_page_selector or listing_url_pattern:
+            pagination = Pagination(next_page_selector, listing_url_pattern)
+
         args = (
             start_ch,
             end_ch,
@@ -169,7 +307,9 @@ class MangaScraperApp:
 
         # Start the scraping thread
         scraping_thread = threading.Thread(
-            target=self.manga_scraper.start_scraping, args=args
+            target=self.manga_scraper.start_scraping,
+            args=args,
+            kwargs={"sync": sync, "pagination": pagination},
         )
 
         scraping_thread.start()
@@ -50,8 +50,9 @@ test_cases = [
 
 expected_outputs = [147.2, 139.5, 139.5, 129, 7, 71.5, 1, 113.5, 3, 30, 30, 30.5]
 
-for i, test_case in enumerate(test_cases):
-    result = parse_chapter_number(test_case)
-    print(f"For test case {i+1}, input: '{test_case}'")
-    print(f"Expected output: {expected_outputs[i]}, Actual output: {result}")
-    print("---")
+if __name__ == "__main__":
+    for i, test_case in enumerate(test_cases):
+        result = parse_chapter_number(test_case)
+        print(f"For test case {i+1}, input: '{test_case}'")
+        print(f"Expected output: {expected_outputs[i]}, Actual output: {result}")
+        print("---")